@@ -1,21 +1,36 @@
+import asyncio
 import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import numpy as np
 import pandas as pd
 from alpaca_trade_api.rest import REST, TimeFrame
-import multiprocessing as mp
+
+try:
+    from Utilities.tick_store import TickStore
+except ImportError:
+    # Run as a script from inside Utilities/
+    from tick_store import TickStore
 
 class Alpaca:
 
     key_id: str
     secret_key: str
 
+    store: TickStore
+
     def __init__(self) -> None:
         
         load_dotenv('.env')
         self.key_id = os.getenv('ALPACA_KEY_ID')
         self.secret_key = os.getenv('ALPACA_SECRET_KEY')
 
-    def get_ticket_list(self):
+        self.store = TickStore()
+
+    def get_ticket_list(self, skip_existing: bool = True):
         
         api = REST()
         active_assets = api.list_assets(status='active')  # you could leave out the status to also get the inactive ones
@@ -23,41 +38,251 @@ class Alpaca:
 
         for asset in active_assets:
 
-            if os.path.exists(f'data/{asset.symbol}.csv'):
+            if skip_existing and os.path.exists(f'data/{asset.symbol}.csv'):
                 continue
 
             asset_list.append(asset.symbol)
         
         return asset_list
 
-    def get_ticket_data(self, ticker: str, value: str) -> list:
+    def get_ticket_data(self, ticker: str, value: str) -> np.ndarray:
 
-        t_data = pd.read_csv(f'data/{ticker}.csv')
-        return t_data[value].tolist()
+        # Memory-mapped column from the columnar store; the csv is only
+        # parsed the first time (or after it changes)
+        return self.store.load_column(ticker, value)
         
-def download_historical(sym: str):
+def to_utc(value) -> pd.Timestamp:
 
-        api = REST()
-        sym_df = api.get_bars(sym, TimeFrame.Minute, "2021-04-20", "2022-04-20", adjustment='raw').df
+    ts = pd.Timestamp(value)
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+class TokenBucket:
+
+    # Allows rate acquisitions per second on average, in bursts of at most
+    # capacity
+
+    rate: float
+    capacity: float
+    tokens: float
+    updated: float
+    lock: asyncio.Lock
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+
+        async with self.lock:
+
+            while True:
+
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class HistoricalDownloader:
+
+    # Brings data/{sym}.csv up to date for [start, end). Only the ranges the
+    # file does not cover yet are requested, in chunk_days pieces, with at
+    # most concurrency symbols in flight and rate requests per second
+    # overall. Newer bars are appended chunk by chunk, so an interrupted run
+    # picks up where it stopped; older bars (start moved back) are merged in
+    # once their range is complete. Failures are kept in errors.
+
+    start: pd.Timestamp
+    end: pd.Timestamp
+    chunk: pd.Timedelta
+    concurrency: int
+    max_retries: int
+
+    bucket: TokenBucket
+    clients: threading.local
+    executor: ThreadPoolExecutor
+
+    errors: dict
+    fetched: dict
+
+    def __init__(self, start: str = "2021-04-20", end: str = None, chunk_days: int = 30, concurrency: int = 8,
+                 rate: float = 3.0, max_retries: int = 3) -> None:
+
+        self.start = to_utc(start)
+        self.end = to_utc(end) if end else pd.Timestamp.now(tz='UTC').floor('D')
+        self.chunk = pd.Timedelta(days=chunk_days)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+
+        # Alpaca allows 200 requests a minute; stay under it
+        self.bucket = TokenBucket(rate)
+        self.clients = threading.local()
+        self.executor = ThreadPoolExecutor(concurrency)
+
+        self.errors = defaultdict(list)
+        self.fetched = defaultdict(int)
+
+    def get_api(self) -> REST:
+
+        # One REST client (and HTTP session) per executor thread
+        if not hasattr(self.clients, 'api'):
+            self.clients.api = REST()
+
+        return self.clients.api
+
+    def stored_range(self, sym: str) -> tuple:
+
+        path = f'data/{sym}.csv'
+
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+
+        with open(path, 'rb') as f:
+
+            f.readline()
+            first = f.readline()
+
+            f.seek(max(0, os.path.getsize(path) - 4096))
+            last = [line for line in f.read().splitlines() if line.strip()][-1]
+
+        if not first.strip():
+            return None
+
+        return to_utc(first.split(b',')[0].decode()), to_utc(last.split(b',')[0].decode())
+
+    def missing_ranges(self, sym: str) -> tuple:
+
+        # (older, newer) ranges to fetch; either may be None
+        stored = self.stored_range(sym)
+
+        if stored is None:
+            return None, (self.start, self.end)
+
+        first, last = stored
+        minute = pd.Timedelta(minutes=1)
 
-        if sym_df.empty:
-            print(f'{sym} is empty')
-            return
+        older = (self.start, first) if self.start < first else None
+        newer = (last + minute, self.end) if last + minute < self.end else None
 
-        sym_df.to_csv(f'data/{sym}.csv')
+        return older, newer
+
+    def chunks(self, start: pd.Timestamp, end: pd.Timestamp):
+
+        while start < end:
+            yield start, min(start + self.chunk, end)
+            start += self.chunk
+
+    def fetch(self, sym: str, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+
+        # end is exclusive; the bars API treats it as inclusive
+        end = end - pd.Timedelta(seconds=1)
+        return self.get_api().get_bars(sym, TimeFrame.Minute, start.isoformat(), end.isoformat(), adjustment='raw').df
+
+    async def fetch_chunk(self, sym: str, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(self.max_retries + 1):
+
+            await self.bucket.acquire()
+
+            try:
+                return await loop.run_in_executor(self.executor, self.fetch, sym, start, end)
+
+            except Exception as error:
+                if attempt == self.max_retries:
+                    raise
+
+                print(f'{sym} {start.date()}..{end.date()} failed ({error}), retrying')
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+    def append(self, sym: str, sym_df: pd.DataFrame) -> None:
+
+        path = f'data/{sym}.csv'
+        sym_df.to_csv(path, mode='a', header=not os.path.exists(path))
+
+    def prepend(self, sym: str, older: list) -> None:
+
+        path = f'data/{sym}.csv'
+
+        stored = pd.read_csv(path, index_col=0)
+        stored.index = pd.to_datetime(stored.index, utc=True)
+
+        merged = pd.concat(older + [stored])
+        merged = merged[~merged.index.duplicated(keep='last')]
+
+        tmp_path = f'{path}.tmp'
+        merged.to_csv(tmp_path, index_label='timestamp')
+        os.replace(tmp_path, path)
+
+    async def download_symbol(self, sym: str, semaphore: asyncio.Semaphore) -> None:
+
+        async with semaphore:
+
+            try:
+                older, newer = self.missing_ranges(sym)
+
+                if newer is not None:
+                    for start, end in self.chunks(*newer):
+
+                        sym_df = await self.fetch_chunk(sym, start, end)
+
+                        if not sym_df.empty:
+                            self.append(sym, sym_df)
+                            self.fetched[sym] += len(sym_df)
+
+                if older is not None:
+                    frames = []
+
+                    for start, end in self.chunks(*older):
+                        sym_df = await self.fetch_chunk(sym, start, end)
+
+                        if not sym_df.empty:
+                            frames.append(sym_df)
+                            self.fetched[sym] += len(sym_df)
+
+                    if frames:
+                        self.prepend(sym, frames)
+
+            except Exception as error:
+                self.errors[sym].append(str(error))
+                print(f'{sym} failed: {error}')
+
+    async def run(self, symbols: list) -> None:
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self.download_symbol(sym, semaphore) for sym in symbols))
+
+    def download(self, symbols: list) -> dict:
+
+        os.makedirs('data', exist_ok=True)
+
+        started = time.monotonic()
+        asyncio.run(self.run(symbols))
+        self.executor.shutdown()
+
+        print(f'fetched {sum(self.fetched.values())} bars for {len(self.fetched)} of {len(symbols)} symbols '
+              f'in {time.monotonic() - started:.1f}s, {len(self.errors)} failed')
+
+        for sym, errors in self.errors.items():
+            print(f'  {sym}: {errors[-1]}')
+
+        return self.errors
 
 def download_all_historical():
 
     alpaca = Alpaca()
-    
-    tickers = alpaca.get_ticket_list()
-    pool = mp.Pool(os.cpu_count())
 
-    for ticker in tickers:
-        pool.apply_async(download_historical, args=(ticker,))
-    
-    pool.close()
-    pool.join()
+    tickers = alpaca.get_ticket_list(skip_existing=False)
+    HistoricalDownloader().download(tickers)
 
 def main():
     
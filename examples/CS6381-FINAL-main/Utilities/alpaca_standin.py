@@ -0,0 +1,148 @@
+import json
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+# A local stand-in for the parts of the Alpaca REST API the downloader uses:
+# GET /v2/assets and GET /v2/stocks/{sym}/bars (1Min, paged through
+# next_page_token). Bars are synthetic but deterministic per symbol and
+# minute, covering 13:30-20:00 UTC on weekdays. Requests above max_rate per
+# second get a 429 like the real API. Point the client at it with
+#   APCA_API_BASE_URL=http://127.0.0.1:PORT APCA_API_DATA_URL=http://127.0.0.1:PORT
+# and any APCA_API_KEY_ID / APCA_API_SECRET_KEY.
+
+PAGE_LIMIT = 10000
+
+class AlpacaStandIn:
+
+    symbols: list
+    max_rate: float
+
+    requests: int
+    throttled: int
+    window: list
+    lock: threading.Lock
+
+    def __init__(self, symbols: list, max_rate: float = None) -> None:
+
+        self.symbols = symbols
+        self.max_rate = max_rate
+
+        self.requests = 0
+        self.throttled = 0
+        self.window = []
+        self.lock = threading.Lock()
+
+    def admit(self) -> bool:
+
+        with self.lock:
+
+            self.requests += 1
+
+            if self.max_rate is None:
+                return True
+
+            now = time.monotonic()
+            self.window = [t for t in self.window if now - t < 1.0]
+
+            if len(self.window) >= self.max_rate:
+                self.throttled += 1
+                return False
+
+            self.window.append(now)
+            return True
+
+    def bars(self, sym: str, start: str, end: str, limit: int, page_token: str) -> dict:
+
+        start = pd.Timestamp(page_token or start).tz_convert('UTC').ceil('min')
+        end = pd.Timestamp(end).tz_convert('UTC')
+
+        minutes = pd.date_range(start, end, freq='min')
+        minutes = minutes[(minutes.dayofweek < 5) & (minutes.hour * 60 + minutes.minute >= 13 * 60 + 30) & (minutes.hour < 20)]
+
+        page = minutes[:limit]
+        seed = zlib.crc32(sym.encode())
+
+        bars = []
+        for ts in page:
+            price = 50 + (seed % 200) + ((int(ts.timestamp()) // 60 + seed) % 1000) / 100
+            bars.append({'t': ts.strftime('%Y-%m-%dT%H:%M:%SZ'), 'o': price, 'h': price + 0.05, 'l': price - 0.05,
+                         'c': price + 0.01, 'v': 100 + seed % 50, 'n': 3, 'vw': price})
+
+        next_page_token = minutes[limit].isoformat() if len(minutes) > limit else None
+
+        return {'bars': bars, 'symbol': sym, 'next_page_token': next_page_token}
+
+    def handle(self, path: str) -> tuple:
+
+        if not self.admit():
+            return 429, {'message': 'too many requests.'}
+
+        url = urlsplit(path)
+        parts = [part for part in url.path.split('/') if part]
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if parts == ['v2', 'assets']:
+            return 200, [{'id': sym, 'class': 'us_equity', 'exchange': 'NASDAQ', 'symbol': sym, 'status': 'active',
+                          'tradable': True} for sym in self.symbols]
+
+        if len(parts) == 4 and parts[:2] == ['v2', 'stocks'] and parts[3] == 'bars':
+
+            limit = min(int(query.get('limit') or PAGE_LIMIT), PAGE_LIMIT)
+            return 200, self.bars(parts[2], query['start'], query['end'], limit, query.get('page_token'))
+
+        return 404, {'message': 'Not Found'}
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    standin: AlpacaStandIn
+
+    def do_GET(self) -> None:
+
+        status, payload = self.standin.handle(self.path)
+        data = json.dumps(payload).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+
+        pass
+
+def serve(symbols: list, host: str = '127.0.0.1', port: int = 0, max_rate: float = None) -> ThreadingHTTPServer:
+
+    standin = AlpacaStandIn(symbols, max_rate)
+    handler = type('StandInHandler', (RequestHandler,), {'standin': standin})
+
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.standin = standin
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+def main():
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    symbols = sys.argv[2].split(',') if len(sys.argv) > 2 else ['AAPL', 'MSFT', 'OND', 'CACG', 'AXAS']
+
+    server = serve(symbols, port=port, max_rate=200 / 60)
+
+    print(f"Alpaca stand-in on http://127.0.0.1:{server.server_address[1]} serving {', '.join(symbols)}")
+    threading.Event().wait()
+
+if __name__ == '__main__':
+    main()
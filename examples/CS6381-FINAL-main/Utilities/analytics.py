@@ -0,0 +1,207 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+try:
+    from Utilities import bar_codec
+except ImportError:
+    # Run as a script from inside Utilities/
+    import bar_codec
+
+# Rolling analytics over micro-batches of bar_codec bars. Each ticker keeps
+# just enough of its history (the last window - 1 values of each running
+# series, the last EMA value, the open resample bucket) to continue where the
+# previous batch stopped, and every batch is processed with whole-array
+# NumPy operations, so the cost per bar is O(1) amortized however long the
+# window is.
+
+def rolling_sums(tail: np.ndarray, values: np.ndarray, window: int) -> tuple:
+
+    # Sums (and counts) of the last `window` values ending at each element
+    # of values, with tail holding what came before; returns the new tail
+    series = np.concatenate([tail, values])
+    cumulative = np.concatenate([[0.0], np.cumsum(series)])
+
+    ends = np.arange(len(tail), len(series)) + 1
+    starts = np.maximum(ends - window, 0)
+
+    new_tail = series[len(series) - (window - 1):] if window > 1 else series[:0]
+
+    return cumulative[ends] - cumulative[starts], ends - starts, new_tail
+
+def ema(values: np.ndarray, alpha: float, previous: float) -> np.ndarray:
+
+    # y[k] = (1 - alpha) * y[k - 1] + alpha * x[k], vectorized through
+    # y[k] = d^k * (d * y[-1] + alpha * sum(x[i] * d^-i for i <= k)) with
+    # d = 1 - alpha, in chunks short enough that d^-i stays well in range
+    decay = 1.0 - alpha
+    out = np.empty(len(values))
+
+    if previous is None:
+        previous = values[0]
+
+    chunk = max(1, int(50 / -np.log(decay))) if 0 < decay < 1 else 1
+
+    for start in range(0, len(values), chunk):
+
+        x = values[start:start + chunk]
+        powers = decay ** np.arange(len(x))
+
+        y = powers * (decay * previous + alpha * np.cumsum(x / powers))
+        out[start:start + len(x)] = y
+        previous = y[-1]
+
+    return out
+
+OHLC_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+])
+
+@dataclass
+class WindowUpdate:
+
+    ticker: str
+    timestamp: np.ndarray
+    vwap: np.ndarray
+    ema: np.ndarray
+    volatility: np.ndarray
+    bars: np.ndarray
+
+class TickerAnalytics:
+
+    # window: bars in the rolling VWAP and volatility windows
+    # span: EMA span in bars (alpha = 2 / (span + 1))
+    # period: resampling bucket in ns (default 5 minutes)
+
+    window: int
+    alpha: float
+    period: int
+
+    pv_tail: np.ndarray
+    volume_tail: np.ndarray
+    return_tail: np.ndarray
+    return_sq_tail: np.ndarray
+    last_close: float
+    last_ema: float
+    bucket: np.ndarray
+
+    def __init__(self, window: int = 30, span: int = 20, period: int = 300 * 10**9) -> None:
+
+        self.window = window
+        self.alpha = 2.0 / (span + 1)
+        self.period = period
+
+        self.pv_tail = np.empty(0)
+        self.volume_tail = np.empty(0)
+        self.return_tail = np.empty(0)
+        self.return_sq_tail = np.empty(0)
+        self.last_close = None
+        self.last_ema = None
+        self.bucket = None
+
+    def update(self, bars: np.ndarray) -> tuple:
+
+        # Nothing to carry forward from an empty batch; state is untouched
+        if len(bars) == 0:
+            empty = np.empty(0)
+            return empty, empty, empty, np.empty(0, dtype=OHLC_DTYPE)
+
+        close = bars['close'].astype(np.float64)
+        volume = bars['volume'].astype(np.float64)
+
+        pv, counts, self.pv_tail = rolling_sums(self.pv_tail, close * volume, self.window)
+        v, _, self.volume_tail = rolling_sums(self.volume_tail, volume, self.window)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vwap = np.where(v > 0, pv / v, np.nan)
+
+        ema_values = ema(close, self.alpha, self.last_ema)
+        self.last_ema = ema_values[-1]
+
+        # Log returns; the very first bar of a ticker has none
+        previous = np.concatenate([[self.last_close if self.last_close is not None else np.nan], close[:-1]])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            returns = np.log(close / previous)
+        returns = np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+        self.last_close = close[-1]
+
+        s1, n, self.return_tail = rolling_sums(self.return_tail, returns, self.window)
+        s2, _, self.return_sq_tail = rolling_sums(self.return_sq_tail, returns * returns, self.window)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = (s2 - s1 * s1 / n) / (n - 1)
+        volatility = np.sqrt(np.maximum(np.where(n > 1, variance, np.nan), 0))
+
+        return vwap, ema_values, volatility, self.resample(bars)
+
+    def resample(self, bars: np.ndarray) -> np.ndarray:
+
+        # Completed OHLCV buckets; the latest bucket stays open until a bar
+        # from a later bucket arrives (or flush())
+        buckets = bars['timestamp'] // self.period
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+        ends = np.concatenate([starts[1:], [len(bars)]])
+
+        grouped = np.empty(len(starts), dtype=OHLC_DTYPE)
+        grouped['timestamp'] = buckets[starts] * self.period
+        grouped['open'] = bars['open'][starts]
+        grouped['high'] = np.maximum.reduceat(bars['high'], starts)
+        grouped['low'] = np.minimum.reduceat(bars['low'], starts)
+        grouped['close'] = bars['close'][ends - 1]
+        grouped['volume'] = np.add.reduceat(bars['volume'], starts)
+
+        if self.bucket is not None:
+
+            if self.bucket['timestamp'] == grouped['timestamp'][0]:
+                first = grouped[0]
+                first['open'] = self.bucket['open']
+                first['high'] = max(first['high'], self.bucket['high'])
+                first['low'] = min(first['low'], self.bucket['low'])
+                first['volume'] += self.bucket['volume']
+            else:
+                grouped = np.concatenate([self.bucket[np.newaxis], grouped])
+
+        self.bucket = grouped[-1].copy()
+        return grouped[:-1]
+
+    def flush(self) -> np.ndarray:
+
+        bucket, self.bucket = self.bucket, None
+        return bucket[np.newaxis] if bucket is not None else np.empty(0, dtype=OHLC_DTYPE)
+
+class AnalyticsStage:
+
+    options: dict
+    tickers: dict
+
+    def __init__(self, **options) -> None:
+
+        self.options = options
+        self.tickers = {}
+
+    def update(self, ticker: str, bars: np.ndarray) -> WindowUpdate:
+
+        state = self.tickers.get(ticker)
+        if state is None:
+            state = self.tickers[ticker] = TickerAnalytics(**self.options)
+
+        vwap, ema_values, volatility, resampled = state.update(bars)
+
+        return WindowUpdate(ticker, bars['timestamp'], vwap, ema_values, volatility, resampled)
+
+    def flush(self):
+
+        for ticker, state in self.tickers.items():
+            bars = state.flush()
+            if len(bars):
+                yield WindowUpdate(ticker, bars['timestamp'], np.empty(0), np.empty(0), np.empty(0), bars)
+
+    def decode(self, values: list) -> np.ndarray:
+
+        arrays = [bar_codec.decode(value) for value in values]
+        return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
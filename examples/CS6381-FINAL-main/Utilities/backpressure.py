@@ -0,0 +1,252 @@
+import threading
+import time
+from collections import deque
+
+import kafka.future
+from kafka.errors import KafkaError
+from kafka.errors import KafkaTimeoutError
+
+# A bounded send queue in front of the producer. Every record handed to put()
+# counts against max_bytes from then until the broker acknowledges (or
+# rejects) it, whether it is still waiting here or already in the producer,
+# so max_bytes bounds the memory a burst can take. What happens to a record
+# that does not fit is the policy:
+#
+#   block        put() waits for room (up to block_timeout, then raises
+#                KafkaTimeoutError)
+#   drop-oldest  the oldest records not yet handed to the producer are
+#                dropped to make room (the new one too, if that is not enough)
+#   drop-newest  the new record is dropped
+#
+# Dropped records fail their future with RecordDropped.
+
+POLICIES = ('block', 'drop-oldest', 'drop-newest')
+
+class RecordDropped(KafkaError):
+    pass
+
+class SendQueue:
+
+    send: object
+    max_bytes: int
+    policy: str
+    block_timeout: float
+
+    queue: deque
+    queued_bytes: int
+    in_flight: int
+    in_flight_bytes: int
+
+    enqueued: int
+    delivered: int
+    failed: int
+    dropped: int
+    latency_sum: float
+    latency_max: float
+
+    condition: threading.Condition
+    closed: bool
+    thread: threading.Thread
+
+    def __init__(self, send, max_bytes: int = 64 * 1024 * 1024, policy: str = 'block', block_timeout: float = None) -> None:
+
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(POLICIES)}, not {policy!r}")
+
+        # send(ticker, value) -> producer future, called on the sender thread
+        self.send = send
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+
+        self.enqueued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def used_bytes(self) -> int:
+
+        return self.queued_bytes + self.in_flight_bytes
+
+    def put(self, ticker: str, value: bytes) -> kafka.future.Future:
+
+        size = len(value)
+        future = kafka.future.Future()
+
+        with self.condition:
+
+            if self.closed:
+                raise RuntimeError('send queue is closed')
+
+            if self.used_bytes() + size > self.max_bytes:
+
+                if self.policy == 'block':
+                    if not self.condition.wait_for(lambda: self.used_bytes() + size <= self.max_bytes or not self.used_bytes(), self.block_timeout):
+                        raise KafkaTimeoutError(f'no room for {size} bytes in the send queue after {self.block_timeout}s')
+
+                elif self.policy == 'drop-oldest':
+                    while self.queue and self.used_bytes() + size > self.max_bytes:
+                        self.drop(self.queue.popleft())
+
+                if self.used_bytes() + size > self.max_bytes and self.used_bytes():
+                    self.dropped += 1
+                    return future.failure(RecordDropped(f'send queue full ({self.used_bytes()} of {self.max_bytes} bytes)'))
+
+            self.queue.append((ticker, value, future, time.monotonic()))
+            self.queued_bytes += size
+            self.enqueued += 1
+            self.condition.notify_all()
+
+        return future
+
+    def drop(self, item: tuple) -> None:
+
+        # Caller holds condition
+        ticker, value, future, _ = item
+        self.queued_bytes -= len(value)
+        self.dropped += 1
+
+        future.failure(RecordDropped('dropped for newer records'))
+
+    def run(self) -> None:
+
+        while True:
+
+            with self.condition:
+
+                self.condition.wait_for(lambda: self.queue or self.closed)
+                if not self.queue:
+                    return
+
+                ticker, value, future, queued_at = self.queue.popleft()
+                self.queued_bytes -= len(value)
+                self.in_flight += 1
+                self.in_flight_bytes += len(value)
+
+            try:
+                result = self.send(ticker, value)
+            except Exception as error:
+                self.settle(len(value), queued_at, future, error=error)
+                continue
+
+            result.add_callback(lambda metadata, size=len(value), start=queued_at, f=future: self.settle(size, start, f, metadata=metadata))
+            result.add_errback(lambda error, size=len(value), start=queued_at, f=future: self.settle(size, start, f, error=error))
+
+    def settle(self, size: int, queued_at: float, future: kafka.future.Future, metadata=None, error: Exception = None) -> None:
+
+        # On the producer's I/O thread once the broker has answered
+        latency = time.monotonic() - queued_at
+
+        with self.condition:
+
+            self.in_flight -= 1
+            self.in_flight_bytes -= size
+
+            if error is None:
+                self.delivered += 1
+                self.latency_sum += latency
+                self.latency_max = max(self.latency_max, latency)
+            else:
+                self.failed += 1
+
+            self.condition.notify_all()
+
+        if error is None:
+            future.success(metadata)
+        else:
+            future.failure(error)
+
+    def wait_settled(self, timeout: float = None) -> bool:
+
+        # Until everything put so far has been acknowledged or has failed
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queue and not self.in_flight, timeout)
+
+    def close(self) -> None:
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+        self.thread.join()
+
+    def snapshot(self) -> dict:
+
+        with self.condition:
+            return {
+                'policy': self.policy,
+                'max_bytes': self.max_bytes,
+                'queued_records': len(self.queue),
+                'queued_bytes': self.queued_bytes,
+                'in_flight_records': self.in_flight,
+                'in_flight_bytes': self.in_flight_bytes,
+                'enqueued': self.enqueued,
+                'delivered': self.delivered,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'latency_sum': self.latency_sum,
+                'latency_max': self.latency_max,
+            }
+
+# Producer metrics worth watching next to the queue's own, by their
+# kafka-python names under 'producer-metrics'
+PRODUCER_METRICS = [
+    'request-latency-avg',
+    'request-latency-max',
+    'record-send-rate',
+    'record-error-rate',
+    'record-retry-rate',
+    'batch-size-avg',
+    'records-per-request-avg',
+    'bufferpool-wait-ratio',
+    'outgoing-byte-rate',
+]
+
+class SendMetrics:
+
+    # Turns counter snapshots into rates over the time since the previous
+    # call of rates()
+
+    previous: dict
+    previous_time: float
+
+    def __init__(self) -> None:
+
+        self.previous = None
+        self.previous_time = None
+
+    def rates(self, snapshot: dict, producer_metrics: dict = None) -> dict:
+
+        now = time.monotonic()
+        metrics = dict(snapshot)
+
+        if self.previous is not None and now > self.previous_time:
+
+            elapsed = now - self.previous_time
+            delivered = snapshot['delivered'] - self.previous['delivered']
+
+            metrics['send_rate'] = delivered / elapsed
+            metrics['error_rate'] = (snapshot['failed'] - self.previous['failed']) / elapsed
+            metrics['drop_rate'] = (snapshot['dropped'] - self.previous['dropped']) / elapsed
+            metrics['ack_latency_avg'] = (snapshot['latency_sum'] - self.previous['latency_sum']) / delivered if delivered else None
+
+        self.previous = snapshot
+        self.previous_time = now
+
+        producer = (producer_metrics or {}).get('producer-metrics', {})
+        metrics['producer'] = {name: producer[name] for name in PRODUCER_METRICS if name in producer}
+
+        return metrics
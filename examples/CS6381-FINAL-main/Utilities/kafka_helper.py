@@ -1,37 +1,164 @@
 import os
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from kafka import KafkaAdminClient
 from kafka import KafkaConsumer
 from kafka import KafkaProducer
+from kafka.admin import NewTopic
+from kafka.errors import KafkaError
 import kafka
 
-class Kafka:
+try:
+    from Utilities import transport
+    from Utilities.transport import add_topic_listener
+except ImportError:
+    # Run as a script from inside Utilities/
+    import transport
+    from transport import add_topic_listener
 
-    host_ip: str
-    host_port: str
+# Topics per CreateTopics request; keeps request sizes sane when
+# bootstrapping thousands of ticker topics at once.
+CREATE_TOPICS_BATCH = 1000
 
-    def __init__(self, host_ip: str, host_port: str) -> None:
-        
-        self.host_ip = host_ip
-        self.host_port = host_port
-    
-    def create_topic(self, topic_name: str, num_partitions: int, replication_factor: int) -> None:
-        
-        os.system(f'kafka/bin/kafka-topics.sh --create --zookeeper {self.host_ip}:{self.host_port} --replication-factor {replication_factor} --partitions {num_partitions} --topic {topic_name}')
+class Kafka(transport.Transport):
 
-    def get_consumer(self, topic_name: str) -> KafkaConsumer:
+    metadata_client: KafkaConsumer
 
-        return KafkaConsumer(topic_name, bootstrap_servers=f'{self.host_ip}:9092', group_id='test')
-    
-    def get_producer(self,) -> KafkaProducer:
-        
-        return KafkaProducer(bootstrap_servers=f'{self.host_ip}:9092')
+    admin_client: KafkaAdminClient
+    admin_executor: ThreadPoolExecutor
 
-    def topic_exists(self, topic: str):
+    def __init__(self, host_ip: str, host_port: str, topic_ttl: float = 30.0) -> None:
 
-        consumer = KafkaConsumer(bootstrap_servers=f'{self.host_ip}:9092', group_id='test')
-        server_topics = consumer.topics()
+        super().__init__(host_ip, host_port, topic_ttl)
 
-        if topic in server_topics:
-            return True
-        
-        else:
-            return False
\ No newline at end of file
+        # One long-lived metadata connection per helper, for refresh_topics
+        self.metadata_client = None
+
+        self.admin_client = None
+        self.admin_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='kafka-admin')
+
+    def get_admin_client(self) -> KafkaAdminClient:
+
+        if self.admin_client is None:
+            self.admin_client = KafkaAdminClient(bootstrap_servers=f'{self.host_ip}:9092')
+
+        return self.admin_client
+
+    def create_topics(self, topics, num_partitions: int = 1, replication_factor: int = 1, topic_configs: dict = None) -> dict:
+
+        # topics is either a list of names, which all get num_partitions,
+        # replication_factor and topic_configs, or a dict of
+        # name -> {'num_partitions', 'replication_factor', 'topic_configs'}
+        # overriding those per topic. Returns name -> Future resolving to the
+        # name once the topic exists; topics already on the broker resolve
+        # straight away without being sent.
+        if not isinstance(topics, dict):
+            topics = {topic: {} for topic in topics}
+
+        futures = {}
+        new_topics = []
+        existing = self.refresh_topics()
+
+        for name, spec in topics.items():
+
+            futures[name] = Future()
+
+            if name in existing:
+                futures[name].set_result(name)
+                continue
+
+            new_topics.append(NewTopic(
+                name=name,
+                num_partitions=spec.get('num_partitions', num_partitions),
+                replication_factor=spec.get('replication_factor', replication_factor),
+                topic_configs=spec.get('topic_configs', topic_configs) or {}))
+
+        for i in range(0, len(new_topics), CREATE_TOPICS_BATCH):
+
+            batch = new_topics[i:i + CREATE_TOPICS_BATCH]
+            self.admin_executor.submit(self.send_create_topics, batch, {t.name: futures[t.name] for t in batch})
+
+        return futures
+
+    def send_create_topics(self, batch: list, futures: dict) -> None:
+
+        try:
+            self.get_admin_client().create_topics(batch)
+
+        except Exception as error:
+            # kafka-python raises on the first failed topic of the request
+            # (TopicAlreadyExistsError included) even though the rest may
+            # have been created or have failed differently, so settle each
+            # topic against what the broker actually has now.
+            try:
+                existing = self.refresh_topics()
+            except KafkaError:
+                existing = set()
+
+            for name, future in futures.items():
+                if name not in existing:
+                    future.set_exception(error)
+
+        created = [name for name, future in futures.items() if not future.done()]
+        self.topics_created(created)
+
+        for name in created:
+            futures[name].set_result(name)
+
+    def get_consumer(self, topic_name: str, **configs) -> KafkaConsumer:
+
+        configs.setdefault('group_id', 'test')
+        return KafkaConsumer(topic_name, bootstrap_servers=f'{self.host_ip}:9092', **configs)
+
+    def get_producer(self, **configs) -> KafkaProducer:
+
+        # configs are passed straight to KafkaProducer (linger_ms,
+        # batch_size, compression_type, buffer_memory, max_block_ms, ...)
+        return KafkaProducer(bootstrap_servers=f'{self.host_ip}:9092', **configs)
+
+    def get_metadata_client(self) -> KafkaConsumer:
+
+        # No group_id: metadata lookups never join or rebalance a group
+        if self.metadata_client is None:
+            self.metadata_client = KafkaConsumer(bootstrap_servers=f'{self.host_ip}:9092')
+
+        return self.metadata_client
+
+    def refresh_topics(self) -> set:
+
+        with self.metadata_lock:
+            self.known_topics = set(self.get_metadata_client().topics())
+            self.topics_refreshed = time.monotonic()
+
+            return self.known_topics
+
+    def close(self) -> None:
+
+        self.admin_executor.shutdown(wait=True)
+
+        if self.admin_client is not None:
+            self.admin_client.close()
+            self.admin_client = None
+
+        with self.metadata_lock:
+            if self.metadata_client is not None:
+                self.metadata_client.close()
+                self.metadata_client = None
+
+TRANSPORTS = {
+    'kafka': Kafka,
+    'inproc': transport.InProcessTransport,
+    'zmq': transport.ZmqTransport,
+}
+
+def get_transport(host_ip: str, host_port: str, name: str = None, **options) -> transport.Transport:
+
+    # The backend named by name, or else by $TICK_TRANSPORT (default kafka)
+    name = name or os.environ.get(transport.TRANSPORT_ENV, 'kafka')
+
+    if name not in TRANSPORTS:
+        raise ValueError(f"unknown transport {name!r}, expected one of {', '.join(TRANSPORTS)}")
+
+    return TRANSPORTS[name](host_ip, host_port, **options)
@@ -0,0 +1,288 @@
+import struct
+import threading
+import time
+import uuid
+from itertools import count
+
+# End-to-end latency from Pub to Sub. Pub stamps every record with three
+# Kafka headers: its send time, a sequence number per (topic, key) and an id
+# for the producing process. Sub reads them back and keeps a log-linear
+# (HDR-style) histogram per topic plus gap / reorder counts per key.
+#
+# The send time is a wall clock anchored once and advanced with the
+# monotonic clock, so it can be compared with the consumer's clock but never
+# jumps backwards if NTP steps the system time under the publisher.
+
+HEADER_SENT = 'sent_ns'
+HEADER_SEQ = 'seq'
+HEADER_PRODUCER = 'producer'
+
+INT64 = struct.Struct('>q')
+
+class SendStamper:
+
+    producer_id: bytes
+    wall_anchor: int
+    monotonic_anchor: int
+    sequences: dict
+
+    def __init__(self, producer_id: str = None) -> None:
+
+        self.producer_id = (producer_id or uuid.uuid4().hex[:12]).encode()
+        self.wall_anchor = time.time_ns()
+        self.monotonic_anchor = time.monotonic_ns()
+        self.sequences = {}
+
+    def now_ns(self) -> int:
+
+        return self.wall_anchor + time.monotonic_ns() - self.monotonic_anchor
+
+    def headers(self, topic: str, key: bytes = None) -> list:
+
+        # next() on an itertools.count is atomic, so concurrent senders
+        # never share a sequence number
+        sequence = self.sequences.get((topic, key))
+        if sequence is None:
+            sequence = self.sequences.setdefault((topic, key), count())
+
+        return [
+            (HEADER_SENT, INT64.pack(self.now_ns())),
+            (HEADER_SEQ, INT64.pack(next(sequence))),
+            (HEADER_PRODUCER, self.producer_id),
+        ]
+
+def read_stamp(message) -> tuple:
+
+    # (sent_ns, seq, producer id) or None for unstamped records
+    headers = dict(message.headers or ())
+
+    if HEADER_SENT not in headers or HEADER_SEQ not in headers:
+        return None
+
+    return INT64.unpack(headers[HEADER_SENT])[0], INT64.unpack(headers[HEADER_SEQ])[0], headers.get(HEADER_PRODUCER)
+
+class LatencyHistogram:
+
+    # Values below 2^sub_bits get a bucket each; above that, every power of
+    # two is split into 2^(sub_bits - 1) equal buckets, so a bucket is never
+    # wider than 1 / 2^(sub_bits - 1) of its values (under 1% with the
+    # default 8) while the range up to 2^max_bits takes a few thousand
+    # counters. Values are microseconds; larger ones land in the last bucket.
+    #
+    # Only one thread may record; any thread may read, as readers work on a
+    # copy of the counters and never block the writer.
+
+    sub_bits: int
+    max_bits: int
+    counts: list
+    total: int
+    sum: int
+    max: int
+
+    def __init__(self, sub_bits: int = 8, max_bits: int = 36) -> None:
+
+        self.sub_bits = sub_bits
+        self.max_bits = max_bits
+        self.counts = [0] * (self.index_of((1 << max_bits) - 1) + 1)
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def index_of(self, value: int) -> int:
+
+        bits = value.bit_length()
+        if bits <= self.sub_bits:
+            return value
+
+        shift = bits - self.sub_bits
+        half = 1 << (self.sub_bits - 1)
+
+        return (1 << self.sub_bits) + (shift - 1) * half + (value >> shift) - half
+
+    def value_at(self, index: int) -> int:
+
+        # Highest value that falls in bucket index
+        if index < 1 << self.sub_bits:
+            return index
+
+        half = 1 << (self.sub_bits - 1)
+        shift, offset = divmod(index - (1 << self.sub_bits), half)
+        shift += 1
+
+        return ((offset + half + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+
+        index = min(self.index_of(max(value, 0)), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+
+        # Adds a snapshot of other (same sub_bits / max_bits) into this one
+        for index, bucket in enumerate(list(other.counts)):
+            self.counts[index] += bucket
+
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentiles(self, *percentiles: float) -> list:
+
+        counts = list(self.counts)
+        total = sum(counts)
+
+        if not total:
+            return [None] * len(percentiles)
+
+        targets = sorted((max(1, -(-total * p // 100)), i) for i, p in enumerate(percentiles))
+        results = [None] * len(percentiles)
+
+        seen = 0
+        pending = iter(targets)
+        target, position = next(pending)
+
+        for index, bucket in enumerate(counts):
+
+            seen += bucket
+            while seen >= target:
+                results[position] = min(self.value_at(index), self.max)
+
+                try:
+                    target, position = next(pending)
+                except StopIteration:
+                    return results
+
+        return results
+
+class TopicLatency:
+
+    # Single-writer per-topic recorder (see LatencyHistogram)
+
+    histogram: LatencyHistogram
+    received: int
+    unstamped: int
+    gaps: int
+    reordered: int
+    last_seqs: dict
+
+    def __init__(self) -> None:
+
+        self.histogram = LatencyHistogram()
+        self.received = 0
+        self.unstamped = 0
+        self.gaps = 0
+        self.reordered = 0
+        self.last_seqs = {}
+
+    def record(self, message, now_ns: int) -> None:
+
+        self.received += 1
+
+        stamp = read_stamp(message)
+        if stamp is None:
+            self.unstamped += 1
+            return
+
+        sent_ns, seq, producer = stamp
+        self.histogram.record((now_ns - sent_ns) // 1000)
+
+        # Sequences run per (producer, key), and a consumer always sees
+        # every record of the keys it reads
+        stream = (producer, message.key)
+        last = self.last_seqs.get(stream)
+
+        if last is not None:
+            if seq > last + 1:
+                self.gaps += seq - last - 1
+            elif seq <= last:
+                self.reordered += 1
+
+        if last is None or seq > last:
+            self.last_seqs[stream] = seq
+
+class LatencyTracker:
+
+    topics: dict
+    last_report: dict
+    reporter: threading.Thread
+    stopped: threading.Event
+
+    def __init__(self) -> None:
+
+        self.topics = {}
+        self.last_report = {}
+        self.reporter = None
+        self.stopped = threading.Event()
+
+    def record(self, message) -> None:
+
+        recorder = self.topics.get(message.topic)
+        if recorder is None:
+            recorder = self.topics[message.topic] = TopicLatency()
+
+        recorder.record(message, time.time_ns())
+
+    def report(self) -> dict:
+
+        # topic -> latency percentiles in microseconds, throughput since the
+        # previous report and sequence gaps; safe to call from any thread
+        now = time.monotonic()
+        report = {}
+
+        for topic, recorder in list(self.topics.items()):
+
+            histogram = recorder.histogram
+            p50, p99, p999 = histogram.percentiles(50, 99, 99.9)
+
+            received = recorder.received
+            last_received, last_time = self.last_report.get(topic, (0, None))
+            self.last_report[topic] = (received, now)
+
+            report[topic] = {
+                'received': received,
+                'per_second': (received - last_received) / (now - last_time) if last_time and now > last_time else None,
+                'p50_us': p50,
+                'p99_us': p99,
+                'p999_us': p999,
+                'max_us': histogram.max if histogram.total else None,
+                'mean_us': histogram.sum / histogram.total if histogram.total else None,
+                'gaps': recorder.gaps,
+                'reordered': recorder.reordered,
+                'unstamped': recorder.unstamped,
+            }
+
+        return report
+
+    def start_reporter(self, interval: float = 10.0, callback=None) -> threading.Thread:
+
+        callback = callback or print_report
+
+        def run():
+            while not self.stopped.wait(interval):
+                callback(self.report())
+
+        self.stopped.clear()
+        self.reporter = threading.Thread(target=run, daemon=True)
+        self.reporter.start()
+
+        return self.reporter
+
+    def stop_reporter(self) -> None:
+
+        self.stopped.set()
+
+def print_report(report: dict) -> None:
+
+    for topic, stats in report.items():
+
+        if stats['p50_us'] is None:
+            print(f"{topic}: {stats['received']} received, no latency stamps")
+            continue
+
+        rate = f"{stats['per_second']:.0f}/s" if stats['per_second'] is not None else '-'
+        print(f"{topic}: {stats['received']} received ({rate}), latency p50 {stats['p50_us']}us p99 {stats['p99_us']}us "
+              f"p99.9 {stats['p999_us']}us max {stats['max_us']}us, {stats['gaps']} missing, {stats['reordered']} reordered")
@@ -0,0 +1,286 @@
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from kafka import KafkaConsumer
+from kafka import OffsetAndMetadata
+from kafka.errors import CommitFailedError
+
+# What happens to a record whose handler still fails after retries:
+#
+#   stop   its offset stays pending, so nothing from it on is committed, and
+#          the consumer stops; run() raises the handler's error once the
+#          other lanes have drained and what they finished is committed. A
+#          restart resumes at the failed record.
+#   skip   the failure is counted and logged and the record is committed
+#          like a handled one
+ON_ERROR_POLICIES = ('stop', 'skip')
+
+class OffsetTracker:
+
+    # Tracks which offsets handed to workers are still being handled. The
+    # committable offset of a partition is the lowest one still pending, or
+    # one past the highest seen once everything before it is done, so a
+    # commit never skips a record whose handler has not finished.
+
+    lock: threading.Lock
+    pending: defaultdict
+    next_offsets: dict
+    committed: dict
+
+    def __init__(self) -> None:
+
+        self.lock = threading.Lock()
+        self.pending = defaultdict(set)
+        self.next_offsets = {}
+        self.committed = {}
+
+    def add(self, tp, offset: int) -> None:
+
+        with self.lock:
+            self.pending[tp].add(offset)
+            self.next_offsets[tp] = max(self.next_offsets.get(tp, 0), offset + 1)
+
+    def done(self, tp, offset: int) -> None:
+
+        with self.lock:
+            self.pending[tp].discard(offset)
+
+    def pending_count(self) -> int:
+
+        with self.lock:
+            return sum(len(offsets) for offsets in self.pending.values())
+
+    def committable(self) -> dict:
+
+        offsets = {}
+
+        with self.lock:
+            for tp, next_offset in self.next_offsets.items():
+
+                pending = self.pending[tp]
+                offset = min(pending) if pending else next_offset
+
+                if self.committed.get(tp) != offset:
+                    offsets[tp] = offset
+
+        return offsets
+
+    def mark_committed(self, offsets: dict) -> None:
+
+        with self.lock:
+            self.committed.update(offsets)
+
+class ParallelConsumer:
+
+    # Runs handler(record) for every record of consumer on a pool of lanes.
+    # Each lane is a thread working through its own queue in order, and a
+    # record always goes to the same lane for its partition (ordering =
+    # 'partition') or its key (ordering = 'key'), so per-partition / per-key
+    # order is kept while other lanes carry on. With processes=True the lane
+    # threads hand the handler to a process pool, which lets CPU-heavy
+    # handlers use every core; the handler must then be picklable. observer,
+    # if given, sees every record on the polling thread as it is fetched.
+    # A failing handler is retried `retries` times, then on_error applies
+    # (see ON_ERROR_POLICIES).
+
+    consumer: KafkaConsumer
+    handler: object
+    observer: object
+    workers: int
+    ordering: str
+    on_error: str
+    retries: int
+
+    max_records: int
+    max_pending: int
+    commit_interval: float
+
+    lanes: list
+    threads: list
+    pool: ProcessPoolExecutor
+    tracker: OffsetTracker
+
+    handled: int
+    failed: int
+    error: Exception
+    stats_lock: threading.Lock
+    running: bool
+    paused: bool
+
+    def __init__(self, consumer: KafkaConsumer, handler, workers: int = None, ordering: str = 'partition', processes: bool = False,
+                 max_records: int = 500, max_pending: int = 10000, commit_interval: float = 5.0, observer=None,
+                 on_error: str = 'stop', retries: int = 2) -> None:
+
+        if ordering not in ('partition', 'key'):
+            raise ValueError(f"ordering must be 'partition' or 'key', not {ordering!r}")
+
+        if on_error not in ON_ERROR_POLICIES:
+            raise ValueError(f"on_error must be one of {', '.join(ON_ERROR_POLICIES)}, not {on_error!r}")
+
+        if consumer.config.get('enable_auto_commit'):
+            raise ValueError('parallel consumption commits offsets itself, create the consumer with enable_auto_commit=False')
+
+        self.consumer = consumer
+        self.handler = handler
+        self.observer = observer
+        self.workers = workers or os.cpu_count()
+        self.ordering = ordering
+        self.on_error = on_error
+        self.retries = retries
+
+        self.max_records = max_records
+        self.max_pending = max_pending
+        self.commit_interval = commit_interval
+
+        self.lanes = [queue.Queue() for _ in range(self.workers)]
+        self.threads = []
+        self.pool = ProcessPoolExecutor(self.workers) if processes else None
+        self.tracker = OffsetTracker()
+
+        self.handled = 0
+        self.failed = 0
+        self.error = None
+        self.stats_lock = threading.Lock()
+        self.running = False
+        self.paused = False
+
+    def lane_for(self, tp, record) -> queue.Queue:
+
+        key = record.key if self.ordering == 'key' and record.key is not None else tp
+        return self.lanes[hash(key) % self.workers]
+
+    def run_lane(self, lane: queue.Queue) -> None:
+
+        while True:
+
+            item = lane.get()
+            if item is None:
+                break
+
+            tp, record = item
+
+            try:
+                self.handle(record)
+
+                with self.stats_lock:
+                    self.handled += 1
+
+            except Exception as error:
+                with self.stats_lock:
+                    self.failed += 1
+
+                print(f"handler failed on {tp.topic}-{tp.partition}@{record.offset}: {error}")
+
+                if self.on_error == 'stop':
+                    # The offset stays pending, and so does the rest of
+                    # this lane, which is left unprocessed
+                    with self.stats_lock:
+                        self.error = self.error or error
+
+                    self.running = False
+                    break
+
+            self.tracker.done(tp, record.offset)
+
+    def handle(self, record) -> None:
+
+        for attempt in range(self.retries + 1):
+
+            try:
+                if self.pool is not None:
+                    self.pool.submit(self.handler, record).result()
+                else:
+                    self.handler(record)
+
+                return
+
+            except Exception:
+                if attempt == self.retries:
+                    raise
+
+                time.sleep(min(0.1 * 2 ** attempt, 5.0))
+
+    def commit(self) -> None:
+
+        offsets = self.tracker.committable()
+        if not offsets:
+            return
+
+        try:
+            self.consumer.commit({tp: OffsetAndMetadata(offset, '') for tp, offset in offsets.items()})
+            self.tracker.mark_committed(offsets)
+
+        except CommitFailedError as error:
+            # Partitions moved to another member; it resumes from the last
+            # successful commit
+            print(f"offset commit failed: {error}")
+
+    def apply_backpressure(self) -> None:
+
+        pending = self.tracker.pending_count()
+
+        if not self.paused and pending >= self.max_pending:
+            self.consumer.pause(*self.consumer.assignment())
+            self.paused = True
+
+        elif self.paused and pending < self.max_pending // 2:
+            self.consumer.resume(*self.consumer.paused())
+            self.paused = False
+
+    def run(self) -> None:
+
+        self.running = True
+
+        for lane in self.lanes:
+            thread = threading.Thread(target=self.run_lane, args=(lane,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        last_commit = time.monotonic()
+
+        try:
+            while self.running:
+
+                self.apply_backpressure()
+                batches = self.consumer.poll(timeout_ms=100, max_records=self.max_records)
+
+                for tp, records in batches.items():
+                    for record in records:
+                        if self.observer is not None:
+                            self.observer(record)
+
+                        self.tracker.add(tp, record.offset)
+                        self.lane_for(tp, record).put((tp, record))
+
+                if time.monotonic() - last_commit >= self.commit_interval:
+                    self.commit()
+                    last_commit = time.monotonic()
+
+        finally:
+            self.shutdown()
+
+        if self.error is not None:
+            raise self.error
+
+    def stop(self) -> None:
+
+        self.running = False
+
+    def shutdown(self) -> None:
+
+        # Let the lanes drain what was already handed out, then commit it
+        for lane in self.lanes:
+            lane.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+        self.threads = []
+        self.commit()
+
+        if self.pool is not None:
+            self.pool.shutdown()
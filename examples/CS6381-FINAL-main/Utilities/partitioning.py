@@ -0,0 +1,61 @@
+import csv
+
+from kafka.partitioner.default import murmur2
+
+# Records are keyed by ticker, and the producer's default partitioner hashes
+# keys with murmur2, the same stable hash the Java client uses. partition_for
+# reproduces that choice, so a consumer can work out which partition holds a
+# ticker without reading anything.
+
+def partition_for(key: bytes, num_partitions: int) -> int:
+
+    return (murmur2(key) & 0x7fffffff) % num_partitions
+
+class TopicRouter:
+
+    # Decides where a ticker is published: its own topic by default, or a
+    # shared '{sector_prefix}{sector}' topic for tickers given a sector.
+    # New topics get num_partitions partitions.
+
+    num_partitions: int
+    replication_factor: int
+    sectors: dict
+    sector_prefix: str
+
+    def __init__(self, num_partitions: int = 1, replication_factor: int = 1, sectors: dict = None, sector_prefix: str = 'sector-') -> None:
+
+        self.num_partitions = num_partitions
+        self.replication_factor = replication_factor
+        self.sectors = sectors or {}
+        self.sector_prefix = sector_prefix
+
+    @classmethod
+    def from_csv(cls, path: str, **options) -> 'TopicRouter':
+
+        # ticker,sector rows
+        with open(path) as f:
+            sectors = {row['ticker']: row['sector'] for row in csv.DictReader(f)}
+
+        return cls(sectors=sectors, **options)
+
+    def topic_for(self, ticker: str) -> str:
+
+        sector = self.sectors.get(ticker)
+        return f'{self.sector_prefix}{sector}' if sector else ticker
+
+    def key_for(self, ticker: str) -> bytes:
+
+        return ticker.encode()
+
+    def partition_for(self, ticker: str, num_partitions: int = None) -> int:
+
+        return partition_for(self.key_for(ticker), num_partitions or self.num_partitions)
+
+    def topics_for(self, tickers: list) -> dict:
+
+        # topic -> tickers published on it
+        topics = {}
+        for ticker in tickers:
+            topics.setdefault(self.topic_for(ticker), []).append(ticker)
+
+        return topics
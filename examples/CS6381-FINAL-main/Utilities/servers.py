@@ -1,40 +1,173 @@
 import os
-from time import sleep
+import socket
+import struct
+import subprocess
+import time
+
+ZOOKEEPER_PORT = 2181
+KAFKA_PORT = 9092
+
+def port_open(host: str, port: int, timeout: float = 0.5) -> bool:
+
+    try:
+        with socket.create_connection((host, port), timeout):
+            return True
+    except OSError:
+        return False
+
+def probe_zookeeper(host: str, port: int = ZOOKEEPER_PORT, timeout: float = 1.0) -> bool:
+
+    # Four-letter-word 'ruok'; a serving ZooKeeper answers 'imok'. One that
+    # has ruok off the 4lw whitelist still answers, which also means it is
+    # up and serving.
+    try:
+        with socket.create_connection((host, port), timeout) as s:
+            s.settimeout(timeout)
+            s.sendall(b'ruok')
+            s.shutdown(socket.SHUT_WR)
+            reply = s.recv(128)
+
+    except OSError:
+        return False
+
+    return reply == b'imok' or b'whitelist' in reply
+
+def recv_exactly(s: socket.socket, size: int) -> bytes:
+
+    data = b''
+    while len(data) < size:
+        chunk = s.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+
+    return data
+
+def probe_kafka(host: str, port: int = KAFKA_PORT, timeout: float = 1.0) -> bool:
+
+    # MetadataRequest v0 for all topics; the broker is ready once it answers
+    # with at least one live broker registered
+    correlation_id = 6381
+    client_id = b'servers'
+
+    request = struct.pack('>hhih', 3, 0, correlation_id, len(client_id)) + client_id + struct.pack('>i', 0)
+
+    try:
+        with socket.create_connection((host, port), timeout) as s:
+            s.settimeout(timeout)
+            s.sendall(struct.pack('>i', len(request)) + request)
+
+            size, = struct.unpack('>i', recv_exactly(s, 4))
+            response = recv_exactly(s, size)
+
+    except (OSError, ConnectionError, struct.error):
+        return False
+
+    if len(response) < 8:
+        return False
+
+    response_id, num_brokers = struct.unpack('>ii', response[:8])
+    return response_id == correlation_id and num_brokers > 0
+
+def wait_until(check, deadline: float, interval: float = 0.05) -> bool:
+
+    while True:
+
+        if check():
+            return True
+
+        if time.monotonic() >= deadline:
+            return False
+
+        time.sleep(interval)
+
+class ServerStartError(RuntimeError):
+    pass
 
 class Servers:
 
-    def __init__(self) -> None:
-        pass
+    host: str
+    timeout: float
+    timings: dict
 
-    def start_servers(self) -> None:
-        
-        os.system('sudo rm -rf /tmp/kafka-logs')
+    def __init__(self, host: str = '127.0.0.1', timeout: float = 60.0) -> None:
 
-        while True:
-            status = os.popen('sudo kafka/bin/zookeeper-server-stop.sh').read()
-            if 'No' in status:
-                print(status)
-                break
-        
-        while True:
-            status = os.popen('sudo kafka/bin/kafka-server-stop.sh').read()
-            if 'No' in status:
+        self.host = host
+        self.timeout = timeout
+        self.timings = {}
+
+    def phase(self, name: str, action) -> object:
+
+        start = time.monotonic()
+        result = action()
+        self.timings[name] = time.monotonic() - start
+
+        print(f"{name}: {self.timings[name]:.2f}s")
+        return result
+
+    def stop(self, script: str, port: int) -> None:
+
+        # Stop scripts only signal the server; wait for it to let go of its
+        # port instead of re-running the script until it reports 'No ...'
+        deadline = time.monotonic() + self.timeout
+
+        while port_open(self.host, port):
+
+            status = os.popen(f'sudo {script}').read()
+            if status:
                 print(status)
+
+            if wait_until(lambda: not port_open(self.host, port), min(deadline, time.monotonic() + 5)):
                 break
 
+            if time.monotonic() >= deadline:
+                raise ServerStartError(f'{script} did not stop the server on port {port}')
+
+    def launch(self, script: str, config: str, log_path: str) -> subprocess.Popen:
+
+        # The child keeps its own copy of the descriptor
+        with open(log_path, 'w') as log:
+            return subprocess.Popen(['sudo', script, config], stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+    def wait_ready(self, name: str, process: subprocess.Popen, probe) -> None:
+
+        deadline = time.monotonic() + self.timeout
+
+        def ready() -> bool:
+            if process.poll() is not None:
+                raise ServerStartError(f'{name} exited with {process.returncode} before becoming ready')
+            return probe(self.host)
+
+        if not wait_until(ready, deadline):
+            raise ServerStartError(f'{name} not ready after {self.timeout:.0f}s')
+
+    def start_servers(self) -> dict:
+
+        start = time.monotonic()
+
+        # Kafka first: a broker left without its ZooKeeper hangs on shutdown
+        self.phase('stop kafka', lambda: self.stop('kafka/bin/kafka-server-stop.sh', KAFKA_PORT))
+        self.phase('stop zookeeper', lambda: self.stop('kafka/bin/zookeeper-server-stop.sh', ZOOKEEPER_PORT))
+
         os.system('sudo rm -rf /tmp/kafka-logs')
         os.system('sudo rm -rf output/*')
+        os.makedirs('output', exist_ok=True)
 
-        os.system('sudo nohup kafka/bin/zookeeper-server-start.sh kafka/config/zookeeper.properties > output/z.txt &')
-        sleep(20)
-        os.system('sudo nohup kafka/bin/kafka-server-start.sh kafka/config/server.properties > output/k.txt &')
+        zookeeper = self.launch('kafka/bin/zookeeper-server-start.sh', 'kafka/config/zookeeper.properties', 'output/z.txt')
+        self.phase('zookeeper ready', lambda: self.wait_ready('zookeeper', zookeeper, probe_zookeeper))
+
+        kafka = self.launch('kafka/bin/kafka-server-start.sh', 'kafka/config/server.properties', 'output/k.txt')
+        self.phase('kafka ready', lambda: self.wait_ready('kafka', kafka, probe_kafka))
 
         #os.system('sudo kafka/bin/kafka-del-topics.sh')
-        sleep(10)
+        self.timings['total'] = time.monotonic() - start
+        print(f"servers up in {self.timings['total']:.2f}s")
+
+        return self.timings
 
 def main():
     servers = Servers()
     servers.start_servers()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,148 @@
+import json
+import multiprocessing as mp
+import os
+
+import numpy as np
+import pandas as pd
+
+# Columnar copy of the data/{ticker}.csv bar files: one .npy file per column
+# under data/columns/{ticker}/, plus a meta.json describing them. Reads
+# memory-map just the column asked for, so nothing is parsed and only the
+# pages that get touched are read from disk. Timestamps are stored as int64
+# nanoseconds since the epoch (UTC).
+
+class TickStore:
+
+    data_dir: str
+    root: str
+
+    def __init__(self, data_dir: str = 'data') -> None:
+
+        self.data_dir = data_dir
+        self.root = os.path.join(data_dir, 'columns')
+
+    def csv_path(self, ticker: str) -> str:
+
+        return os.path.join(self.data_dir, f'{ticker}.csv')
+
+    def column_dir(self, ticker: str) -> str:
+
+        return os.path.join(self.root, ticker)
+
+    def read_meta(self, ticker: str) -> dict:
+
+        try:
+            with open(os.path.join(self.column_dir(ticker), 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_current(self, ticker: str) -> bool:
+
+        meta = self.read_meta(ticker)
+        if meta is None:
+            return False
+
+        try:
+            return meta['source_mtime_ns'] == os.stat(self.csv_path(ticker)).st_mtime_ns
+        except OSError:
+            # The csv is gone but the columns are still there
+            return True
+
+    def convert(self, ticker: str) -> dict:
+
+        source_mtime_ns = os.stat(self.csv_path(ticker)).st_mtime_ns
+        t_data = pd.read_csv(self.csv_path(ticker))
+
+        columns = {}
+
+        for name in t_data.columns:
+
+            column = t_data[name]
+
+            if name == 'timestamp':
+                values = pd.to_datetime(column, utc=True).to_numpy(dtype='datetime64[ns]').view(np.int64)
+            elif pd.api.types.is_numeric_dtype(column):
+                values = column.to_numpy()
+            else:
+                continue
+
+            columns[name] = np.ascontiguousarray(values)
+
+        column_dir = self.column_dir(ticker)
+        os.makedirs(column_dir, exist_ok=True)
+
+        for name, values in columns.items():
+            # np.save appends .npy to the name, hence the .tmp.npy
+            tmp_path = os.path.join(column_dir, f'{name}.tmp.npy')
+            np.save(tmp_path, values, allow_pickle=False)
+            os.replace(tmp_path, os.path.join(column_dir, f'{name}.npy'))
+
+        meta = {
+            'ticker': ticker,
+            'rows': len(t_data),
+            'columns': {name: values.dtype.str for name, values in columns.items()},
+            'source_mtime_ns': source_mtime_ns,
+        }
+
+        # meta.json goes last, so a half-written conversion is never current
+        tmp_path = os.path.join(column_dir, 'meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(column_dir, 'meta.json'))
+
+        return meta
+
+    def ensure(self, ticker: str) -> dict:
+
+        if not self.is_current(ticker):
+            return self.convert(ticker)
+
+        return self.read_meta(ticker)
+
+    def load_column(self, ticker: str, column: str) -> np.ndarray:
+
+        meta = self.ensure(ticker)
+
+        if column not in meta['columns']:
+            raise KeyError(f'{ticker} has no column {column!r}, it has {list(meta["columns"])}')
+
+        return np.load(os.path.join(self.column_dir(ticker), f'{column}.npy'), mmap_mode='r', allow_pickle=False)
+
+    def iter_column(self, ticker: str, column: str, chunk_size: int = 65536):
+
+        values = self.load_column(ticker, column)
+
+        for start in range(0, len(values), chunk_size):
+            yield from values[start:start + chunk_size].tolist()
+
+    def tickers(self) -> list:
+
+        return sorted(f[:-len('.csv')] for f in os.listdir(self.data_dir) if f.endswith('.csv'))
+
+def convert_ticker(ticker: str) -> None:
+
+    store = TickStore()
+
+    try:
+        store.ensure(ticker)
+    except Exception as error:
+        print(f'failed converting {ticker}: {error}')
+
+def convert_all() -> None:
+
+    store = TickStore()
+    pool = mp.Pool(os.cpu_count())
+
+    for ticker in store.tickers():
+        pool.apply_async(convert_ticker, args=(ticker,))
+
+    pool.close()
+    pool.join()
+
+def main():
+
+    convert_all()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import threading
+
+try:
+    from Utilities import kafka_helper
+except ImportError:
+    # Run as a script from inside Utilities/
+    import kafka_helper
+
+# One watcher per broker per process. Every Sub waiting for a topic registers
+# with it, and a single background thread refreshes topic metadata over one
+# connection: right away when someone new starts waiting, then backing off
+# to max_backoff while nothing appears. Topics created through any Kafka
+# helper in this process wake their waiters immediately.
+
+class TopicWatcher:
+
+    k_utility: kafka_helper.transport.Transport
+
+    min_backoff: float
+    max_backoff: float
+    backoff: float
+
+    waiters: dict
+    condition: threading.Condition
+    thread: threading.Thread
+
+    def __init__(self, host_ip: str, host_port: str, min_backoff: float = 0.1, max_backoff: float = 5.0) -> None:
+
+        self.k_utility = kafka_helper.get_transport(host_ip, host_port)
+
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+
+        self.waiters = {}
+        self.condition = threading.Condition()
+
+        kafka_helper.add_topic_listener(self.notify)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def wait_for(self, topic: str, timeout: float = None) -> bool:
+
+        # Transports without topics of their own (zmq) have nothing to wait for
+        if not self.k_utility.managed_topics:
+            return True
+
+        with self.condition:
+
+            if topic in self.k_utility.known_topics:
+                return True
+
+            event = self.waiters.get(topic)
+
+            if event is None:
+                event = self.waiters[topic] = threading.Event()
+
+                # Look again straight away for the newcomer
+                self.backoff = self.min_backoff
+                self.condition.notify()
+
+        return event.wait(timeout)
+
+    def notify(self, topics) -> None:
+
+        with self.condition:
+            for topic in topics:
+
+                event = self.waiters.pop(topic, None)
+                if event is not None:
+                    event.set()
+
+    def run(self) -> None:
+
+        while True:
+
+            with self.condition:
+                while not self.waiters:
+                    self.condition.wait()
+
+            try:
+                topics = self.k_utility.refresh_topics()
+            except Exception as error:
+                print(f"topic watcher: metadata refresh failed: {error}")
+                topics = set()
+
+            self.notify(topics)
+
+            with self.condition:
+                if self.waiters:
+                    # A new waiter resets backoff and notifies, cutting this short
+                    backoff = self.backoff
+                    self.backoff = min(self.backoff * 2, self.max_backoff)
+                    self.condition.wait(backoff)
+                else:
+                    self.backoff = self.min_backoff
+
+watchers: dict = {}
+watchers_lock = threading.Lock()
+
+def get_watcher(host_ip: str, host_port: str) -> TopicWatcher:
+
+    with watchers_lock:
+
+        watcher = watchers.get((host_ip, host_port))
+
+        if watcher is None:
+            watcher = watchers[(host_ip, host_port)] = TopicWatcher(host_ip, host_port)
+
+        return watcher
@@ -0,0 +1,757 @@
+import itertools
+import threading
+import time
+from abc import ABC
+from abc import abstractmethod
+from collections import namedtuple
+from concurrent.futures import Future
+
+from kafka import OffsetAndMetadata
+from kafka import TopicPartition
+import kafka.future
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+try:
+    from Utilities.partitioning import partition_for
+except ImportError:
+    # Run as a script from inside Utilities/
+    from partitioning import partition_for
+
+# Pub and Sub talk to whatever kafka_helper.get_transport returns: the real
+# Kafka cluster by default, or with TICK_TRANSPORT set in the environment
+#
+#   inproc  an in-memory partitioned log shared by everything in the process,
+#           for benchmarks and offline runs without a broker
+#   zmq     ZeroMQ PUB/SUB through an XSUB/XPUB forwarder (the forwarder
+#           from the Distributed-Systems examples), fire-and-forget with no
+#           retention, for the lowest latency between live processes
+#
+# Every backend hands out producers and consumers with the subset of the
+# KafkaProducer / KafkaConsumer interface this project uses, so nothing above
+# kafka_helper knows which one it got.
+
+TRANSPORT_ENV = 'TICK_TRANSPORT'
+
+# Called with the names of topics once any transport in the process has
+# created them (see topic_watcher)
+topic_listeners = []
+
+def add_topic_listener(listener) -> None:
+
+    topic_listeners.append(listener)
+
+Record = namedtuple('Record', ['topic', 'partition', 'offset', 'timestamp', 'key', 'value', 'headers'])
+RecordMetadata = namedtuple('RecordMetadata', ['topic', 'partition', 'offset', 'timestamp'])
+
+class SettledFuture(kafka.future.Future):
+
+    # What producer.send returns outside Kafka: callbacks added later run
+    # straight away, like on an already delivered FutureRecordMetadata
+
+    def get(self, timeout: float = None):
+
+        if self.exception:
+            raise self.exception
+
+        return self.value
+
+class Transport(ABC):
+
+    # Topic bookkeeping shared by the backends: topic_exists is answered
+    # from known_topics and only goes back to the backend when the cache is
+    # older than topic_ttl or the topic is not known yet. Backends without
+    # topics of their own (managed_topics = False) treat every topic as
+    # existing.
+
+    managed_topics: bool = True
+
+    host_ip: str
+    host_port: str
+
+    topic_ttl: float
+    known_topics: set
+    topics_refreshed: float
+    metadata_lock: threading.Lock
+
+    def __init__(self, host_ip: str, host_port: str, topic_ttl: float = 30.0) -> None:
+
+        self.host_ip = host_ip
+        self.host_port = host_port
+
+        self.topic_ttl = topic_ttl
+        self.known_topics = set()
+        self.topics_refreshed = 0.0
+        self.metadata_lock = threading.Lock()
+
+    @abstractmethod
+    def create_topics(self, topics, num_partitions: int = 1, replication_factor: int = 1, topic_configs: dict = None) -> dict:
+        pass
+
+    @abstractmethod
+    def refresh_topics(self) -> set:
+        pass
+
+    @abstractmethod
+    def get_producer(self, **configs):
+        pass
+
+    @abstractmethod
+    def get_consumer(self, topic_name: str, **configs):
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def create_topic(self, topic_name: str, num_partitions: int, replication_factor: int) -> None:
+
+        self.create_topics([topic_name], num_partitions, replication_factor)[topic_name].result()
+
+    def topics_created(self, names: list) -> None:
+
+        with self.metadata_lock:
+            self.known_topics.update(names)
+
+        for listener in topic_listeners:
+            listener(names)
+
+    def forget_topic(self, topic: str) -> None:
+
+        # Called when the backend reports the topic as unknown (or it was
+        # just created), so the next lookup goes back to it.
+        with self.metadata_lock:
+            self.known_topics.discard(topic)
+            self.topics_refreshed = 0.0
+
+    def topic_exists(self, topic: str):
+
+        if not self.managed_topics:
+            return True
+
+        stale = time.monotonic() - self.topics_refreshed > self.topic_ttl
+
+        if topic in self.known_topics and not stale:
+            return True
+
+        return topic in self.refresh_topics()
+
+class PartitionLog:
+
+    # Records of one partition; the oldest are dropped past retention, and
+    # offsets keep counting from base
+
+    records: list
+    base: int
+
+    def __init__(self) -> None:
+
+        self.records = []
+        self.base = 0
+
+    def end_offset(self) -> int:
+
+        return self.base + len(self.records)
+
+class InProcessBroker:
+
+    # The shared log behind the inproc transport. One condition guards all
+    # of it; appends wake every consumer waiting in poll.
+
+    retention: int
+    condition: threading.Condition
+    partitions: dict
+    committed: dict
+
+    def __init__(self, retention: int = 1000000) -> None:
+
+        self.retention = retention
+        self.condition = threading.Condition()
+        self.partitions = {}
+        self.committed = {}
+
+    def create_topic(self, topic: str, num_partitions: int = 1) -> bool:
+
+        with self.condition:
+
+            if topic in self.partitions:
+                return False
+
+            self.partitions[topic] = [PartitionLog() for _ in range(num_partitions)]
+            self.condition.notify_all()
+
+            return True
+
+    def topics(self) -> set:
+
+        with self.condition:
+            return set(self.partitions)
+
+    def partitions_for(self, topic: str) -> set:
+
+        with self.condition:
+            logs = self.partitions.get(topic)
+            return set(range(len(logs))) if logs is not None else None
+
+    def append(self, topic: str, partition: int, key: bytes, value: bytes, headers: list) -> RecordMetadata:
+
+        timestamp = int(time.time() * 1000)
+
+        with self.condition:
+
+            log = self.partitions[topic][partition]
+            offset = log.end_offset()
+            log.records.append(Record(topic, partition, offset, timestamp, key, value, headers or []))
+
+            if len(log.records) > 2 * self.retention:
+                dropped = len(log.records) - self.retention
+                del log.records[:dropped]
+                log.base += dropped
+
+            self.condition.notify_all()
+
+        return RecordMetadata(topic, partition, offset, timestamp)
+
+    def fetch(self, tp: TopicPartition, offset: int, max_records: int) -> list:
+
+        # Caller holds condition
+        log = self.partitions[tp.topic][tp.partition]
+        start = max(offset - log.base, 0)
+
+        return log.records[start:start + max_records]
+
+    def offsets(self, tp: TopicPartition) -> tuple:
+
+        # Caller holds condition
+        log = self.partitions[tp.topic][tp.partition]
+        return log.base, log.end_offset()
+
+class InProcessProducer:
+
+    broker: InProcessBroker
+    config: dict
+    round_robin: itertools.count
+
+    def __init__(self, broker: InProcessBroker, **configs) -> None:
+
+        self.broker = broker
+        self.config = configs
+        self.round_robin = itertools.count()
+
+    def send(self, topic: str, value=None, key=None, headers: list = None, partition: int = None, timestamp_ms: int = None) -> SettledFuture:
+
+        if self.config.get('value_serializer') and value is not None:
+            value = self.config['value_serializer'](value)
+
+        if self.config.get('key_serializer') and key is not None:
+            key = self.config['key_serializer'](key)
+
+        # Unknown topics are created with one partition, like a broker
+        # with auto.create.topics.enable
+        self.broker.create_topic(topic)
+        num_partitions = len(self.broker.partitions_for(topic))
+
+        if partition is None:
+            partition = partition_for(key, num_partitions) if key is not None else next(self.round_robin) % num_partitions
+
+        return SettledFuture().success(self.broker.append(topic, partition, key, value, headers))
+
+    def flush(self, timeout: float = None) -> None:
+        pass
+
+    def metrics(self) -> dict:
+
+        return {}
+
+    def close(self, timeout: float = None) -> None:
+        pass
+
+class InProcessConsumer:
+
+    # Consumer over the in-process log. Subscribed consumers get every
+    # partition of their topics (there is no group rebalancing); consumers
+    # of a group_id start from the group's committed offsets, otherwise at
+    # auto_offset_reset ('latest' by default, as in KafkaConsumer).
+
+    broker: InProcessBroker
+    config: dict
+
+    subscription: set
+    assigned: list
+    positions: dict
+    paused_partitions: set
+    buffer: list
+
+    def __init__(self, broker: InProcessBroker, *topics, **configs) -> None:
+
+        self.broker = broker
+        self.config = dict({'group_id': None, 'enable_auto_commit': True, 'auto_offset_reset': 'latest',
+                            'consumer_timeout_ms': float('inf')}, **configs)
+
+        self.subscription = set(topics)
+        self.assigned = None
+        self.positions = {}
+        self.paused_partitions = set()
+        self.buffer = []
+
+        self.start_positions()
+
+    def topics(self) -> set:
+
+        return self.broker.topics()
+
+    def partitions_for_topic(self, topic: str) -> set:
+
+        return self.broker.partitions_for(topic)
+
+    def start_positions(self) -> None:
+
+        # Fixed as soon as the partitions are known rather than at the first
+        # poll, so a consumer set up before a publisher starts sees all of
+        # its records
+        with self.broker.condition:
+            for tp in self.assignment():
+                self.position_of(tp)
+
+    def subscribe(self, topics: list) -> None:
+
+        self.subscription = set(topics)
+        self.assigned = None
+        self.start_positions()
+
+    def unsubscribe(self) -> None:
+
+        self.subscription = set()
+        self.positions = {}
+        self.buffer = []
+
+    def assign(self, partitions: list) -> None:
+
+        self.subscription = set()
+        self.assigned = list(partitions)
+        self.start_positions()
+
+    def assignment(self) -> set:
+
+        if self.assigned is not None:
+            return set(self.assigned)
+
+        return {TopicPartition(topic, p) for topic in self.subscription for p in self.broker.partitions_for(topic) or ()}
+
+    def pause(self, *partitions) -> None:
+
+        self.paused_partitions.update(partitions)
+
+    def resume(self, *partitions) -> None:
+
+        self.paused_partitions.difference_update(partitions)
+
+    def paused(self) -> set:
+
+        return set(self.paused_partitions)
+
+    def seek(self, partition: TopicPartition, offset: int) -> None:
+
+        self.positions[partition] = offset
+
+    def position(self, partition: TopicPartition) -> int:
+
+        with self.broker.condition:
+            return self.position_of(partition)
+
+    def committed(self, partition: TopicPartition):
+
+        return self.broker.committed.get((self.config['group_id'], partition))
+
+    def position_of(self, tp: TopicPartition) -> int:
+
+        # Caller holds the broker condition
+        position = self.positions.get(tp)
+
+        if position is None:
+            committed = self.broker.committed.get((self.config['group_id'], tp)) if self.config['group_id'] else None
+            start, end = self.broker.offsets(tp)
+
+            if committed is not None:
+                position = committed
+            else:
+                position = start if self.config['auto_offset_reset'] == 'earliest' else end
+
+            self.positions[tp] = position
+
+        return position
+
+    def poll(self, timeout_ms: int = 0, max_records: int = None, update_offsets: bool = True) -> dict:
+
+        max_records = max_records or self.config.get('max_poll_records', 500)
+        deadline = time.monotonic() + timeout_ms / 1000
+
+        with self.broker.condition:
+
+            while True:
+
+                batches = {}
+                remaining = max_records
+
+                for tp in sorted(self.assignment() - self.paused_partitions):
+
+                    records = self.broker.fetch(tp, self.position_of(tp), remaining)
+                    if records:
+                        batches[tp] = records
+                        self.positions[tp] = records[-1].offset + 1
+                        remaining -= len(records)
+
+                    if not remaining:
+                        break
+
+                left = deadline - time.monotonic()
+                if batches or left <= 0:
+                    break
+
+                self.broker.condition.wait(left)
+
+        if batches and self.config['group_id'] and self.config['enable_auto_commit']:
+            self.commit()
+
+        return batches
+
+    def __iter__(self):
+
+        return self
+
+    def __next__(self):
+
+        timeout = self.config['consumer_timeout_ms']
+        deadline = time.monotonic() + timeout / 1000
+
+        while not self.buffer:
+
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise StopIteration
+
+            batches = self.poll(timeout_ms=min(left * 1000, 1000))
+            self.buffer = [record for records in batches.values() for record in records]
+            self.buffer.reverse()
+
+        return self.buffer.pop()
+
+    def commit(self, offsets: dict = None) -> None:
+
+        if offsets is None:
+            offsets = {tp: OffsetAndMetadata(position, '') for tp, position in self.positions.items()}
+
+        with self.broker.condition:
+            for tp, offset in offsets.items():
+                self.broker.committed[(self.config['group_id'], tp)] = offset.offset if isinstance(offset, OffsetAndMetadata) else offset
+
+    def metrics(self) -> dict:
+
+        return {}
+
+    def close(self, autocommit: bool = True) -> None:
+
+        if autocommit and self.config['group_id'] and self.config['enable_auto_commit']:
+            self.commit()
+
+in_process_broker = InProcessBroker()
+
+class InProcessTransport(Transport):
+
+    broker: InProcessBroker
+
+    def __init__(self, host_ip: str, host_port: str, topic_ttl: float = 30.0, broker: InProcessBroker = None) -> None:
+
+        super().__init__(host_ip, host_port, topic_ttl)
+        self.broker = broker or in_process_broker
+
+    def create_topics(self, topics, num_partitions: int = 1, replication_factor: int = 1, topic_configs: dict = None) -> dict:
+
+        if not isinstance(topics, dict):
+            topics = {topic: {} for topic in topics}
+
+        futures = {}
+        for name, spec in topics.items():
+            self.broker.create_topic(name, spec.get('num_partitions', num_partitions))
+            futures[name] = Future()
+            futures[name].set_result(name)
+
+        self.topics_created(list(topics))
+
+        return futures
+
+    def refresh_topics(self) -> set:
+
+        with self.metadata_lock:
+            self.known_topics = self.broker.topics()
+            self.topics_refreshed = time.monotonic()
+
+            return self.known_topics
+
+    def get_producer(self, **configs) -> InProcessProducer:
+
+        return InProcessProducer(self.broker, **configs)
+
+    def get_consumer(self, topic_name: str, **configs) -> InProcessConsumer:
+
+        configs.setdefault('group_id', 'test')
+        return InProcessConsumer(self.broker, topic_name, **configs)
+
+# Forwarder ports on host_ip: publishers connect to the XSUB side,
+# subscribers to the XPUB side
+ZMQ_XSUB_PORT = 5559
+ZMQ_XPUB_PORT = 5560
+
+def run_forwarder(xsub_port: int = ZMQ_XSUB_PORT, xpub_port: int = ZMQ_XPUB_PORT) -> None:
+
+    context = zmq.Context.instance()
+
+    xsub = context.socket(zmq.XSUB)
+    xsub.bind(f'tcp://*:{xsub_port}')
+
+    xpub = context.socket(zmq.XPUB)
+    xpub.setsockopt(zmq.XPUB_VERBOSE, 1)
+    xpub.bind(f'tcp://*:{xpub_port}')
+
+    zmq.proxy(xsub, xpub)
+
+def start_forwarder(xsub_port: int = ZMQ_XSUB_PORT, xpub_port: int = ZMQ_XPUB_PORT) -> threading.Thread:
+
+    thread = threading.Thread(target=run_forwarder, args=(xsub_port, xpub_port), daemon=True)
+    thread.start()
+
+    return thread
+
+def topic_frame(topic: str) -> bytes:
+
+    # Subscriptions match on prefix; the terminator keeps 'AA' from
+    # receiving 'AAPL'
+    return topic.encode() + b'\0'
+
+class ZmqProducer:
+
+    # Frames: topic, key, value, then header name / value pairs. Delivery is
+    # fire-and-forget, and anything sent before a subscriber has connected
+    # is lost (ZeroMQ's slow joiner).
+
+    socket: object
+    lock: threading.Lock
+    config: dict
+
+    def __init__(self, address: str, **configs) -> None:
+
+        self.config = configs
+        self.lock = threading.Lock()
+
+        self.socket = zmq.Context.instance().socket(zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, configs.get('sndhwm', 100000))
+        self.socket.connect(address)
+
+    def send(self, topic: str, value=None, key=None, headers: list = None, partition: int = None, timestamp_ms: int = None) -> SettledFuture:
+
+        if self.config.get('value_serializer') and value is not None:
+            value = self.config['value_serializer'](value)
+
+        if self.config.get('key_serializer') and key is not None:
+            key = self.config['key_serializer'](key)
+
+        frames = [topic_frame(topic), key or b'', value or b'']
+        for name, header in headers or ():
+            frames += [name.encode(), header]
+
+        # zmq sockets are not thread safe
+        with self.lock:
+            self.socket.send_multipart(frames, copy=False)
+
+        return SettledFuture().success(RecordMetadata(topic, 0, -1, timestamp_ms or int(time.time() * 1000)))
+
+    def flush(self, timeout: float = None) -> None:
+        pass
+
+    def metrics(self) -> dict:
+
+        return {}
+
+    def close(self, timeout: float = None) -> None:
+
+        self.socket.close(linger=int(timeout * 1000) if timeout is not None else 1000)
+
+class ZmqConsumer:
+
+    # Every topic is a single partition 0; offsets count the records this
+    # consumer has received, and commits are accepted but mean nothing
+
+    socket: object
+    poller: object
+    config: dict
+
+    offsets: dict
+    assigned: set
+    buffer: list
+
+    def __init__(self, address: str, *topics, **configs) -> None:
+
+        self.config = dict({'group_id': None, 'enable_auto_commit': True, 'consumer_timeout_ms': float('inf')}, **configs)
+
+        self.socket = zmq.Context.instance().socket(zmq.SUB)
+        self.socket.setsockopt(zmq.RCVHWM, configs.get('rcvhwm', 100000))
+        self.socket.connect(address)
+
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+
+        self.offsets = {}
+        self.assigned = set()
+        self.buffer = []
+
+        self.subscribe(topics)
+
+    def topics(self) -> set:
+
+        return {tp.topic for tp in self.assigned}
+
+    def partitions_for_topic(self, topic: str) -> set:
+
+        return {0}
+
+    def subscribe(self, topics) -> None:
+
+        self.assign([TopicPartition(topic, 0) for topic in topics])
+
+    def unsubscribe(self) -> None:
+
+        self.assign([])
+
+    def assign(self, partitions: list) -> None:
+
+        partitions = set(partitions)
+
+        for tp in self.assigned - partitions:
+            self.socket.setsockopt(zmq.UNSUBSCRIBE, topic_frame(tp.topic))
+
+        for tp in partitions - self.assigned:
+            self.socket.setsockopt(zmq.SUBSCRIBE, topic_frame(tp.topic))
+
+        self.assigned = partitions
+
+    def assignment(self) -> set:
+
+        return set(self.assigned)
+
+    def pause(self, *partitions) -> None:
+        pass
+
+    def resume(self, *partitions) -> None:
+        pass
+
+    def paused(self) -> set:
+
+        return set()
+
+    def poll(self, timeout_ms: int = 0, max_records: int = None, update_offsets: bool = True) -> dict:
+
+        max_records = max_records or self.config.get('max_poll_records', 500)
+        batches = {}
+
+        if not self.poller.poll(timeout_ms):
+            return batches
+
+        for _ in range(max_records):
+
+            try:
+                frames = self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+            topic = frames[0][:-1].decode()
+            tp = TopicPartition(topic, 0)
+
+            offset = self.offsets.get(tp, 0)
+            self.offsets[tp] = offset + 1
+
+            headers = [(frames[i].decode(), frames[i + 1]) for i in range(3, len(frames) - 1, 2)]
+            record = Record(topic, 0, offset, int(time.time() * 1000), frames[1] or None, frames[2], headers)
+
+            batches.setdefault(tp, []).append(record)
+
+        return batches
+
+    def __iter__(self):
+
+        return self
+
+    def __next__(self):
+
+        timeout = self.config['consumer_timeout_ms']
+        deadline = time.monotonic() + timeout / 1000
+
+        while not self.buffer:
+
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise StopIteration
+
+            batches = self.poll(timeout_ms=min(left * 1000, 1000))
+            self.buffer = [record for records in batches.values() for record in records]
+            self.buffer.reverse()
+
+        return self.buffer.pop()
+
+    def commit(self, offsets: dict = None) -> None:
+        pass
+
+    def metrics(self) -> dict:
+
+        return {}
+
+    def close(self, autocommit: bool = True) -> None:
+
+        self.socket.close(linger=0)
+
+class ZmqTransport(Transport):
+
+    managed_topics = False
+
+    def __init__(self, host_ip: str, host_port: str, topic_ttl: float = 30.0) -> None:
+
+        if zmq is None:
+            raise ImportError('the zmq transport needs pyzmq')
+
+        super().__init__(host_ip, host_port, topic_ttl)
+
+    def create_topics(self, topics, num_partitions: int = 1, replication_factor: int = 1, topic_configs: dict = None) -> dict:
+
+        # Topics are just subscription prefixes; nothing to create
+        futures = {}
+        for name in topics:
+            futures[name] = Future()
+            futures[name].set_result(name)
+
+        self.topics_created(list(topics))
+
+        return futures
+
+    def refresh_topics(self) -> set:
+
+        return self.known_topics
+
+    def get_producer(self, **configs) -> ZmqProducer:
+
+        return ZmqProducer(f'tcp://{self.host_ip}:{ZMQ_XSUB_PORT}', **configs)
+
+    def get_consumer(self, topic_name: str, **configs) -> ZmqConsumer:
+
+        return ZmqConsumer(f'tcp://{self.host_ip}:{ZMQ_XPUB_PORT}', topic_name, **configs)
+
+def main():
+
+    # python transport.py forwarder: run the zmq transport's forwarder
+    import sys
+
+    if sys.argv[1:2] == ['forwarder']:
+        run_forwarder()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+import pub
+import sub
+from Utilities import alpaca
+from Utilities import bar_codec
+from Utilities import transport
+from Utilities.latency import LatencyHistogram
+from Utilities.partitioning import TopicRouter
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# End-to-end benchmark of the tick pipeline: N publishers x M subscribers x
+# K tickers, each a thread in this process, pushing bar_codec messages
+# through Pub and Sub on the chosen transport at a target total rate (or as
+# fast as they can) and writing a JSON report:
+#
+#   python bench_pipeline.py --pubs 2 --subs 2 --tickers 20 --messages 200000
+#   python bench_pipeline.py --transport kafka --rate 5000 --output kafka.json
+#
+# The in-process transport is the default, so runs need no broker and are
+# comparable across commits on the same machine. Kafka runs go to the broker
+# on --host; zmq runs start their own XSUB/XPUB forwarder in this process. Ticker bars come from the
+# local store (data/*.csv) when there is one and are generated from a fixed
+# seed otherwise.
+
+def parse_args(argv: list) -> argparse.Namespace:
+
+    parser = argparse.ArgumentParser(description='Benchmark the Pub -> Sub tick pipeline')
+    parser.add_argument('--transport', default='inproc', choices=['inproc', 'kafka', 'zmq'])
+    parser.add_argument('--host', default='127.0.0.1', help='broker (kafka) or forwarder (zmq) address')
+    parser.add_argument('--pubs', type=int, default=1, help='publisher threads')
+    parser.add_argument('--subs', type=int, default=1, help='subscriber threads, each reading a disjoint share of the tickers')
+    parser.add_argument('--tickers', type=int, default=10)
+    parser.add_argument('--partitions', type=int, default=1, help='partitions per ticker topic')
+    parser.add_argument('--messages', type=int, default=100000, help='messages to publish in total')
+    parser.add_argument('--batch', type=int, default=1, help='bars per message')
+    parser.add_argument('--rate', type=float, default=0, help='target messages/s over all publishers, 0 for maximum')
+    parser.add_argument('--drain', type=float, default=10.0, help='seconds to wait for subscribers after publishing')
+    parser.add_argument('--seed', type=int, default=6381)
+    parser.add_argument('--output', default='bench_pipeline.json')
+
+    args = parser.parse_args(argv)
+
+    if args.subs > args.tickers:
+        parser.error('--subs cannot exceed --tickers, each subscriber needs tickers of its own')
+
+    return args
+
+def load_bars(tickers: int, batch: int, seed: int) -> dict:
+
+    # ticker -> bar_codec messages; real bars where the store has them
+    store = alpaca.Alpaca().store
+    names = store.tickers()[:tickers] if os.path.isdir(store.data_dir) else []
+
+    rng = np.random.default_rng(seed)
+    messages = {}
+
+    for name in names:
+        messages[name] = list(bar_codec.encode_batches(bar_codec.bars_from_store(store, name), 'bar', batch))
+
+    for i in range(len(names), tickers):
+
+        bars = np.zeros(1000 * batch, dtype=bar_codec.BAR_DTYPE)
+        bars['timestamp'] = np.arange(len(bars)) * 60 * 10**9
+        bars['close'] = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, len(bars))))
+        bars['open'] = bars['high'] = bars['low'] = bars['close']
+        bars['volume'] = rng.integers(1, 1000, len(bars))
+
+        messages[f'BENCH{i}'] = list(bar_codec.encode_batches(bars, 'bar', batch))
+
+    return messages
+
+class ResourceSampler:
+
+    # Process CPU time and peak RSS over the run
+
+    interval: float
+    peak_rss: int
+    process: object
+    start_cpu: tuple
+    stopped: threading.Event
+    thread: threading.Thread
+
+    def __init__(self, interval: float = 0.2) -> None:
+
+        self.interval = interval
+        self.peak_rss = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+        self.process = psutil.Process() if psutil else None
+        self.start_cpu = self.cpu_times()
+
+    def cpu_times(self) -> tuple:
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime, usage.ru_stime
+
+    def rss(self) -> int:
+
+        if self.process is not None:
+            return self.process.memory_info().rss
+
+        # ru_maxrss is already a peak, in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def run(self) -> None:
+
+        while not self.stopped.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self.rss())
+
+    def start(self) -> None:
+
+        self.thread.start()
+
+    def stop(self, elapsed: float) -> dict:
+
+        self.stopped.set()
+        self.thread.join()
+        self.peak_rss = max(self.peak_rss, self.rss())
+
+        user, system = (end - start for start, end in zip(self.start_cpu, self.cpu_times()))
+
+        return {
+            'cpu_user_s': round(user, 3),
+            'cpu_system_s': round(system, 3),
+            'cpu_percent': round(100 * (user + system) / elapsed, 1),
+            'peak_rss_mb': round(self.peak_rss / 2**20, 1),
+        }
+
+def publish(p: pub.Pub, work: list, rate: float) -> None:
+
+    # work is [(ticker, message)], sent at rate messages/s from a fixed
+    # schedule (so a slow send is caught up on, not added to every gap)
+    interval = 1 / rate if rate else 0
+    start = time.perf_counter()
+
+    for i, (ticker, value) in enumerate(work):
+
+        if interval:
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        p.send(ticker, value)
+
+    p.flush()
+
+def subscribe(s: sub.Sub, counts: list, index: int, stopped: threading.Event) -> None:
+
+    while not stopped.is_set():
+
+        batches = s.consumer.poll(timeout_ms=100, max_records=10000)
+
+        for messages in batches.values():
+            for message in messages:
+                if s.observe(message):
+                    counts[index] += 1
+
+def git_commit() -> str:
+
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args: argparse.Namespace) -> dict:
+
+    os.environ[transport.TRANSPORT_ENV] = args.transport
+
+    messages = load_bars(args.tickers, args.batch, args.seed)
+    tickers = sorted(messages)
+    router = TopicRouter(num_partitions=args.partitions)
+    run_id = uuid.uuid4().hex[:8]
+
+    if args.transport == 'zmq':
+        transport.start_forwarder()
+
+    # Each publisher sends its share of the tickers round-robin
+    pubs = [pub.Pub(verbose=False, router=router, host_ip=args.host) for _ in range(args.pubs)]
+    pubs[0].create_topics(tickers)
+
+    per_pub = args.messages // args.pubs
+    work = []
+    for i in range(args.pubs):
+
+        own = tickers[i::args.pubs] or tickers
+        sends = []
+
+        for n in range(per_pub):
+            ticker = own[n % len(own)]
+            sends.append((ticker, messages[ticker][n // len(own) % len(messages[ticker])]))
+
+        work.append(sends)
+
+    # Subscribers split the tickers between them; fresh groups every run
+    subs = []
+    for j in range(args.subs):
+
+        s = sub.Sub.for_tickers(tickers[j::args.subs], router, host_ip=args.host, group_id=f'bench-{run_id}-{j}')
+        s.consumer.poll(timeout_ms=100)
+        subs.append(s)
+
+    # zmq drops whatever is published before the subscriptions have reached
+    # the forwarder (the slow joiner), so give them time to get there
+    if args.transport == 'zmq':
+        time.sleep(1.0)
+
+    received = [0] * args.subs
+    stopped = threading.Event()
+
+    sampler = ResourceSampler()
+    sampler.start()
+    start = time.perf_counter()
+
+    sub_threads = [threading.Thread(target=subscribe, args=(s, received, j, stopped), daemon=True) for j, s in enumerate(subs)]
+    pub_threads = [threading.Thread(target=publish, args=(p, w, args.rate / args.pubs), daemon=True) for p, w in zip(pubs, work)]
+
+    for thread in sub_threads + pub_threads:
+        thread.start()
+
+    for thread in pub_threads:
+        thread.join()
+
+    published_at = time.perf_counter()
+    published = sum(p.delivered for p in pubs)
+    expected = per_pub * args.pubs
+
+    # The subscribers between them read every ticker once
+    deadline = time.monotonic() + args.drain
+    while sum(received) < expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    elapsed = time.perf_counter() - start
+    stopped.set()
+
+    for thread in sub_threads:
+        thread.join()
+
+    resources = sampler.stop(elapsed)
+
+    histogram = LatencyHistogram()
+    gaps = 0
+    for s in subs:
+        for recorder in s.latency.topics.values():
+            histogram.merge(recorder.histogram)
+            gaps += recorder.gaps
+
+    p50, p99, p999 = histogram.percentiles(50, 99, 99.9)
+
+    for p in pubs:
+        p.close()
+
+    return {
+        'config': vars(args),
+        'environment': {
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'results': {
+            'published': published,
+            'publish_failed': sum(p.failed for p in pubs),
+            'received': sum(received),
+            'lost': expected - sum(received),
+            'gaps': gaps,
+            'publish_seconds': round(published_at - start, 3),
+            'elapsed_seconds': round(elapsed, 3),
+            'publish_per_second': round(published / (published_at - start), 1),
+            'receive_per_second': round(sum(received) / elapsed, 1),
+            'bars_per_second': round(sum(received) * args.batch / elapsed, 1),
+            'latency_p50_us': p50,
+            'latency_p99_us': p99,
+            'latency_p999_us': p999,
+            'latency_max_us': histogram.max if histogram.total else None,
+            **resources,
+        },
+    }
+
+def main():
+
+    args = parse_args(sys.argv[1:])
+
+    report = run(args)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    results = report['results']
+    print(f"{args.pubs} pubs x {args.subs} subs x {args.tickers} tickers over {args.transport}: "
+          f"{results['publish_per_second']:,.0f} msgs/s published, {results['receive_per_second']:,.0f} msgs/s received, "
+          f"latency p50 {results['latency_p50_us']}us p99 {results['latency_p99_us']}us p99.9 {results['latency_p999_us']}us, "
+          f"cpu {results['cpu_percent']}%, peak rss {results['peak_rss_mb']}MB, {results['lost']} lost")
+    print(f"report written to {args.output}")
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import pub
+
+import sys
+import time
+
+# (label, producer configs) run one after another against the same broker
+SETTINGS = [
+    ('default', {}),
+    ('linger 5ms / 64KB', {'linger_ms': 5, 'batch_size': 64 * 1024}),
+    ('linger 10ms / 128KB', {'linger_ms': 10, 'batch_size': 128 * 1024}),
+    ('linger 20ms / 512KB', {'linger_ms': 20, 'batch_size': 512 * 1024}),
+    ('linger 20ms / 512KB gzip', {'linger_ms': 20, 'batch_size': 512 * 1024, 'compression_type': 'gzip'}),
+]
+
+def run(label: str, configs: dict, topic: str, num_messages: int) -> float:
+
+    p = pub.Pub.high_throughput(**configs) if configs else pub.Pub(verbose=False)
+
+    # Make sure the topic is created and cached before the clock starts
+    p.publish(topic, 0.0)
+    p.flush()
+
+    start = time.perf_counter()
+
+    for i in range(num_messages):
+        p.publish(topic, 100.0 + (i % 1000) / 100)
+
+    p.flush()
+    elapsed = time.perf_counter() - start
+    p.close()
+
+    rate = num_messages / elapsed
+    print(f"{label:<28} {rate:>12,.0f} msgs/s  {elapsed:>8.2f}s  delivered={p.delivered - 1} failed={p.failed}")
+
+    return rate
+
+def main():
+
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    topic = sys.argv[2] if len(sys.argv) > 2 else 'bench-pub'
+
+    print(f"publishing {num_messages} messages per setting to {topic}")
+
+    for label, configs in SETTINGS:
+        run(label, configs, topic, num_messages)
+
+
+
+if __name__ == '__main__':
+    main()
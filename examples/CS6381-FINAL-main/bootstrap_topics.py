@@ -0,0 +1,33 @@
+from Utilities import kafka_helper
+
+import os
+import sys
+import time
+
+def main():
+
+    num_partitions = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    replication_factor = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    tickers = sorted(f[:-len('.csv')] for f in os.listdir('data') if f.endswith('.csv'))
+
+    k = kafka_helper.get_transport('10.0.0.1', '2181')
+
+    start = time.time()
+    futures = k.create_topics(tickers, num_partitions, replication_factor)
+
+    failed = 0
+    for ticker, future in futures.items():
+        try:
+            future.result()
+        except Exception as error:
+            failed += 1
+            print(f"failed creating {ticker}: {error}")
+
+    print(f"{len(futures) - failed} topics ready, {failed} failed in {time.time() - start:.2f}s")
+    k.close()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,192 @@
+from Utilities import bar_codec
 from Utilities import kafka_helper
+from Utilities.backpressure import SendMetrics
+from Utilities.backpressure import SendQueue
+from Utilities.latency import SendStamper
+from Utilities.partitioning import TopicRouter
 
 from kafka import KafkaProducer
+from kafka.errors import UnknownTopicOrPartitionError
+
+import atexit
+import threading
+from collections import deque
+
+# Producer settings for the high-throughput mode: batch for up to 10ms or
+# 128KB per partition, and block send() for at most 10s once 64MB of records
+# are waiting for the broker instead of growing without bound.
+THROUGHPUT_CONFIG = {
+    'linger_ms': 10,
+    'batch_size': 128 * 1024,
+    'buffer_memory': 64 * 1024 * 1024,
+    'max_block_ms': 10000,
+    'acks': 1,
+}
 
 class Pub:
 
-    k_utility: kafka_helper.Kafka
+    k_utility: kafka_helper.transport.Transport
     producer: KafkaProducer
 
     topic: str
+    verbose: bool
+    router: TopicRouter
+    stamper: SendStamper
+
+    delivered: int
+    failed: int
+    errors: deque
+    stats_lock: threading.Lock
+
+    send_queue: SendQueue
+    send_metrics: SendMetrics
+    reporter_stopped: threading.Event
+
+    closed: bool
+
+    def __init__(self, verbose: bool = True, router: TopicRouter = None, backpressure: str = None,
+                 max_queued_bytes: int = 64 * 1024 * 1024, block_timeout: float = None, host_ip: str = '10.0.0.1', **producer_configs):
+
+        self.verbose = verbose
+        self.router = router or TopicRouter()
+        self.stamper = SendStamper()
+
+        self.delivered = 0
+        self.failed = 0
+        self.errors = deque(maxlen=100)
+        self.stats_lock = threading.Lock()
+        self.closed = False
+
+        self.k_utility = kafka_helper.get_transport(host_ip, '2181')
+        self.producer = self.k_utility.get_producer(**producer_configs)
+
+        # With a backpressure policy ('block', 'drop-oldest' or
+        # 'drop-newest') sends go through a queue holding at most
+        # max_queued_bytes of unacknowledged records, drained into the
+        # producer by its own thread (see Utilities/backpressure.py)
+        self.send_queue = SendQueue(self.dispatch, max_queued_bytes, backpressure, block_timeout) if backpressure else None
+        self.send_metrics = SendMetrics()
+        self.reporter_stopped = threading.Event()
+
+        # Whatever is still batched in the producer goes out before exit
+        atexit.register(self.close)
+
+    @classmethod
+    def high_throughput(cls, compression_type: str = None, router: TopicRouter = None, **producer_configs):
+
+        configs = dict(THROUGHPUT_CONFIG, compression_type=compression_type)
+        configs.update(producer_configs)
+
+        return cls(verbose=False, router=router, **configs)
+
+    def create_topics(self, tickers: list) -> dict:
+
+        return self.k_utility.create_topics(list(self.router.topics_for(tickers)), self.router.num_partitions, self.router.replication_factor)
+
+    def publish(self, ticker: str, data: str):
+
+        if self.verbose:
+            print(f"publishing {data} to {self.router.topic_for(ticker)}")
+
+        return self.send(ticker, str.encode(str(data)))
+
+    def publish_records(self, ticker: str, records, schema: str = 'bar', batch_size: int = 100) -> list:
+
+        # records is a bar_codec structured array (e.g. from
+        # bar_codec.bars_from_store); batch_size records go in each message
+        if self.verbose:
+            print(f"publishing {len(records)} {schema} records to {self.router.topic_for(ticker)}")
+
+        return [self.send(ticker, value) for value in bar_codec.encode_batches(records, schema, batch_size)]
+
+    def send(self, ticker: str, value: bytes):
+
+        # Returns a future of the record's delivery; with a backpressure
+        # policy it fails with RecordDropped if the record was dropped
+        if self.send_queue is not None:
+            return self.send_queue.put(ticker, value)
+
+        return self.dispatch(ticker, value)
+
+    def dispatch(self, ticker: str, value: bytes):
+
+        # Routed to the ticker's own topic or its sector topic, keyed by
+        # ticker so each ticker stays in order on one partition. The headers
+        # carry the send time and sequence number Sub measures latency with.
+        topic = self.router.topic_for(ticker)
+        key = self.router.key_for(ticker)
 
-    def __init__(self):
-        
-        self.k_utility = kafka_helper.Kafka('10.0.0.1', '2181')
-        self.producer = self.k_utility.get_producer()
-    
-    def publish(self, topic: str, data: str):
-        
         if not self.k_utility.topic_exists(topic):
-            self.k_utility.create_topic(topic, 1, 1)
+            self.k_utility.create_topic(topic, self.router.num_partitions, self.router.replication_factor)
+
+        future = self.producer.send(topic, value, key=key, headers=self.stamper.headers(topic, key))
+        future.add_callback(self.handle_delivery)
+        future.add_errback(self.handle_send_error, topic)
+
+        return future
+
+    def handle_delivery(self, metadata):
+
+        with self.stats_lock:
+            self.delivered += 1
+
+    def handle_send_error(self, topic: str, error: Exception):
+
+        # The topic was deleted (or never made it) since it was cached
+        if isinstance(error, UnknownTopicOrPartitionError):
+            self.k_utility.forget_topic(topic)
+
+        with self.stats_lock:
+            self.failed += 1
+            self.errors.append((topic, error))
+
+        print(f"failed publishing to {topic}: {error}")
+
+    def flush(self, timeout: float = None):
+
+        if self.send_queue is not None:
+            self.send_queue.wait_settled(timeout)
+
+        self.producer.flush(timeout)
+
+    def metrics(self) -> dict:
+
+        # Live counters: the send queue's bytes / records (queued and in
+        # flight), rates since the previous call, and the producer's own
+        # request latency, batch and error metrics
+        if self.send_queue is not None:
+            snapshot = self.send_queue.snapshot()
+        else:
+            with self.stats_lock:
+                snapshot = {'policy': None, 'delivered': self.delivered, 'failed': self.failed, 'dropped': 0, 'latency_sum': 0.0}
+
+        return self.send_metrics.rates(snapshot, self.producer.metrics())
+
+    def start_metrics_reporter(self, interval: float = 10.0, callback=None) -> threading.Thread:
+
+        callback = callback or print
+
+        def run():
+            while not self.reporter_stopped.wait(interval):
+                callback(self.metrics())
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+
+        return thread
+
+    def close(self):
+
+        if self.closed:
+            return
+
+        self.closed = True
+        atexit.unregister(self.close)
+        self.reporter_stopped.set()
 
-        print(f"publishing {data} to {topic}")
-        self.producer.send(topic, str.encode(str(data)))
+        if self.send_queue is not None:
+            self.send_queue.close()
 
-    
\ No newline at end of file
+        self.producer.flush()
+        self.producer.close()
+        self.k_utility.close()
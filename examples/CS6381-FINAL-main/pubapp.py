@@ -1,24 +1,30 @@
 import pub
-from Utilities import alpaca
+import replay
 
 import sys
-from time import sleep
 
 def main():
-    
-    ticker = sys.argv[1]
-    data_type = sys.argv[2]
 
-    a = alpaca.Alpaca()
-    p = pub.Pub()
+    # pubapp.py TICKER[,TICKER...] DATA_TYPE [SPEED]
+    # DATA_TYPE is a bar column (close, volume, ...) sent as text, or 'bars'
+    # for whole binary bar_codec bars. SPEED is the replay speed-up over the
+    # bar timestamps (default 60, so one minute bar a second); 'max'
+    # publishes as fast as possible
+    tickers = sys.argv[1].split(',')
+    data_type = sys.argv[2]
+    speed = sys.argv[3] if len(sys.argv) > 3 else '60'
 
-    data = a.get_ticket_data(ticker, data_type)
+    if speed == 'max':
+        p = pub.Pub.high_throughput()
+        engine = replay.ReplayEngine(p, speed=0)
+    else:
+        p = pub.Pub(verbose=len(tickers) == 1)
+        engine = replay.ReplayEngine(p, speed=float(speed))
 
-    for data_point in data:
-        p.publish(ticker, data_point)
-        sleep(1)
+    engine.run(tickers, data_type)
+    p.close()
 
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
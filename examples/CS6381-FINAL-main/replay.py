@@ -0,0 +1,158 @@
+import pub
+from Utilities import alpaca
+from Utilities import bar_codec
+
+import heapq
+import random
+import time
+
+class DriftStats:
+
+    # How late each send was against its schedule, in seconds. Percentiles
+    # come from a reservoir sample of at most max_samples drifts.
+
+    max_samples: int = 100000
+
+    count: int
+    total: float
+    worst: float
+    samples: list
+
+    def __init__(self) -> None:
+
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.samples = []
+
+    def add(self, drift: float) -> None:
+
+        self.count += 1
+        self.total += drift
+        self.worst = max(self.worst, drift)
+
+        if len(self.samples) < self.max_samples:
+            self.samples.append(drift)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self.max_samples:
+                self.samples[slot] = drift
+
+    def percentile(self, q: float) -> float:
+
+        if not self.samples:
+            return 0.0
+
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self) -> str:
+
+        mean = self.total / self.count if self.count else 0.0
+        return (f"{self.count} sent, drift mean {mean * 1000:.2f}ms "
+                f"p50 {self.percentile(0.5) * 1000:.2f}ms p99 {self.percentile(0.99) * 1000:.2f}ms "
+                f"max {self.worst * 1000:.2f}ms")
+
+class ReplayEngine:
+
+    # Publishes the bars of many tickers through one Pub in bar-timestamp
+    # order. A bar stamped t is due (t - first bar) / speed seconds after
+    # the replay starts; speed 0 sends as fast as possible. Quiet stretches
+    # in the data (nights, weekends) are cut to max_gap seconds of replay
+    # (wall-clock) time so a 60x replay does not idle for hours.
+
+    publisher: pub.Pub
+    a: alpaca.Alpaca
+
+    speed: float
+    max_gap: float
+    report_interval: float
+
+    stats: DriftStats
+    window: DriftStats
+
+    def __init__(self, publisher: pub.Pub, speed: float = 60.0, max_gap: float = 300.0, report_interval: float = 10.0) -> None:
+
+        self.publisher = publisher
+        self.a = alpaca.Alpaca()
+
+        self.speed = speed
+        self.max_gap = max_gap
+        self.report_interval = report_interval
+
+        self.stats = DriftStats()
+        self.window = DriftStats()
+
+    def ticker_events(self, ticker: str, column: str, chunk_size: int = 65536):
+
+        # (timestamp, ticker, row, value); the row keeps the merge from ever
+        # comparing values. column 'bars' replays whole OHLCV bars, one
+        # bar_codec record per message.
+        timestamps = self.a.store.load_column(ticker, 'timestamp')
+
+        if column == 'bars':
+            records = bar_codec.bars_from_store(self.a.store, ticker)
+
+            for row, ts in enumerate(timestamps.tolist()):
+                yield ts, ticker, row, records[row:row + 1]
+
+            return
+
+        values = self.a.get_ticket_data(ticker, column)
+
+        for start in range(0, len(timestamps), chunk_size):
+
+            end = start + chunk_size
+            for row, (ts, value) in enumerate(zip(timestamps[start:end].tolist(), values[start:end].tolist()), start):
+                yield ts, ticker, row, value
+
+    def events(self, tickers: list, column: str):
+
+        return heapq.merge(*(self.ticker_events(ticker, column) for ticker in tickers))
+
+    def run(self, tickers: list, column: str, create_timeout: float = 60.0) -> DriftStats:
+
+        # The topics have to exist before the first send, or Kafka may
+        # auto-create them with its default partition count; result()
+        # raises if one could not be created
+        for future in self.publisher.create_topics(tickers).values():
+            future.result(timeout=create_timeout)
+
+        start = time.perf_counter()
+        last_report = start
+
+        previous_ts = None
+        offset = 0.0
+
+        for ts, ticker, row, value in self.events(tickers, column):
+
+            if previous_ts is not None and self.speed:
+                # Replay-time seconds since the first bar, with gaps capped
+                offset += min((ts - previous_ts) / 1e9 / self.speed, self.max_gap)
+            previous_ts = ts
+
+            due = start + offset if self.speed else time.perf_counter()
+
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+            if column == 'bars':
+                self.publisher.publish_records(ticker, value, batch_size=1)
+            else:
+                self.publisher.publish(ticker, value)
+
+            now = time.perf_counter()
+            drift = max(0.0, now - due)
+            self.stats.add(drift)
+            self.window.add(drift)
+
+            if now - last_report >= self.report_interval:
+                print(f"replay: {self.window.summary()} ({self.window.count / (now - last_report):.0f} msgs/s)")
+                self.window = DriftStats()
+                last_report = now
+
+        self.publisher.flush()
+        print(f"replay done in {time.perf_counter() - start:.2f}s: {self.stats.summary()}")
+
+        return self.stats
@@ -1,37 +1,187 @@
+from Utilities import bar_codec
 from Utilities import kafka_helper
+from Utilities.analytics import AnalyticsStage
+from Utilities.latency import LatencyTracker
+from Utilities import topic_watcher
+from Utilities.parallel_consumer import ParallelConsumer
+from Utilities.partitioning import TopicRouter
 
 from kafka import KafkaConsumer
-from time import sleep
+from kafka import TopicPartition
+from kafka.errors import KafkaTimeoutError
+
+import time
 
 class Sub:
 
     consumer: KafkaConsumer
-    k_utility: kafka_helper.Kafka
+    k_utility: kafka_helper.transport.Transport
 
     topic: str
+    keys: set
+    workers: int
+    latency: LatencyTracker
+
+    def __init__(self, topic: str, workers: int = 0, host_ip: str = '10.0.0.1', **consumer_configs):
 
-    def __init__(self, topic: str):
-        
         self.topic = topic
+        self.keys = None
+
+        # recieve's default; parallel consumption commits offsets itself,
+        # so the consumer is then created without auto-commit
+        self.workers = workers
+        if workers:
+            consumer_configs.setdefault('enable_auto_commit', False)
 
-        self.k_utility = kafka_helper.Kafka('10.0.0.1', '2181')
+        # Produce-to-consume latency of every record received; read it with
+        # latency.report() or latency.start_reporter(interval)
+        self.latency = LatencyTracker()
+
+        self.k_utility = kafka_helper.get_transport(host_ip, '2181')
         self.wait_for_topic_creation()
 
-        self.consumer = self.k_utility.get_consumer(self.topic)
+        self.consumer = self.k_utility.get_consumer(self.topic, **consumer_configs)
+
+    @classmethod
+    def for_tickers(cls, tickers: list, router: TopicRouter = None, **consumer_configs):
+
+        router = router or TopicRouter()
+
+        s = cls(router.topic_for(tickers[0]), **consumer_configs)
+        s.assign_tickers(tickers, router)
+
+        return s
+
+    def wait_for_topic_creation(self, topic: str = None):
+
+        # Shared with every other Sub in the process: one metadata
+        # connection however many are waiting
+        watcher = topic_watcher.get_watcher(self.k_utility.host_ip, self.k_utility.host_port)
+
+        while not watcher.wait_for(topic or self.topic, timeout=5):
+            print("waiting for topic to be created")
+
+    def partitions_for(self, topic: str, timeout: float = 30.0) -> set:
+
+        # The topic watcher only knows the topic exists; this consumer's own
+        # metadata may not list it yet, and partitions_for_topic is None
+        # until it does
+        deadline = time.monotonic() + timeout
+        delay = 0.1
+
+        while True:
+
+            partitions = self.consumer.partitions_for_topic(topic)
+            if partitions:
+                return partitions
+
+            if time.monotonic() >= deadline:
+                raise KafkaTimeoutError(f'no partitions for {topic} in the consumer metadata after {timeout}s')
+
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            delay = min(delay * 2, 2.0)
+
+    def assign_tickers(self, tickers: list, router: TopicRouter, timeout: float = 30.0) -> list:
+
+        # Read only the partitions the tickers hash to (the same choice the
+        # producer's partitioner makes) instead of whole topics, and drop
+        # other tickers sharing those partitions. Consumers given disjoint
+        # tickers split a hot topic between them.
+        assignment = set()
+
+        for topic, topic_tickers in router.topics_for(tickers).items():
+
+            self.wait_for_topic_creation(topic)
+            num_partitions = len(self.partitions_for(topic, timeout))
+
+            for ticker in topic_tickers:
+                assignment.add(TopicPartition(topic, router.partition_for(ticker, num_partitions)))
 
-    def wait_for_topic_creation(self):
+        self.consumer.unsubscribe()
+        self.consumer.assign(sorted(assignment))
+        self.keys = {router.key_for(ticker) for ticker in tickers}
+
+        return sorted(assignment)
+
+    @staticmethod
+    def decode_records(message):
+
+        # Zero-copy structured array over a bar_codec message; or pass
+        # value_deserializer=bar_codec.decode to the constructor
+        return bar_codec.decode(message.value)
+
+    def wanted(self, message) -> bool:
+
+        return self.keys is None or message.key in self.keys
+
+    def observe(self, message) -> bool:
+
+        # Always called from the polling thread, the latency recorders'
+        # single writer
+        if not self.wanted(message):
+            return False
+
+        self.latency.record(message)
+        return True
+
+    def stream_analytics(self, stage: AnalyticsStage = None, max_records: int = 10000, timeout_ms: int = 100):
+
+        # Yields an analytics.WindowUpdate per ticker per poll: every bar
+        # message in the micro-batch is decoded and the ticker's bars are
+        # pushed through the stage together. Tickers are read from the
+        # message key (the topic for unkeyed messages).
+        stage = stage or AnalyticsStage()
 
         while True:
 
-            if self.k_utility.topic_exists(self.topic):
-                break
+            batch = self.consumer.poll(timeout_ms=timeout_ms, max_records=max_records)
+            values = {}
+
+            for messages in batch.values():
+                for message in messages:
+                    if self.observe(message):
+                        ticker = message.key.decode() if message.key else message.topic
+                        values.setdefault(ticker, []).append(message.value)
+
+            for ticker, ticker_values in values.items():
+                yield stage.update(ticker, stage.decode(ticker_values))
+
+    def recieve(self, handler=None, workers: int = None, ordering: str = 'partition', processes: bool = False, on_error: str = 'stop'):
+
+        handler = handler or print
+        workers = self.workers if workers is None else workers
+
+        if not workers:
+            for message in self.consumer:
+                if self.observe(message):
+                    handler(message)
+
+            return
+
+        if self.consumer.config.get('enable_auto_commit'):
+            raise ValueError('this Sub auto-commits offsets; create it with Sub(topic, workers=N) to recieve with workers')
+
+        if self.keys is not None:
+            handler = KeyFilter(handler, self.keys)
+
+        engine = ParallelConsumer(self.consumer, handler, workers, ordering, processes, observer=self.observe, on_error=on_error)
+        engine.run()
+
+class KeyFilter:
+
+    # A picklable handler wrapper, so the key filter also works with
+    # processes=True
+
+    handler: object
+    keys: set
+
+    def __init__(self, handler, keys: set):
 
-            else:
-                sleep(1)
-                print("waiting for topic to be created")
+        self.handler = handler
+        self.keys = keys
 
+    def __call__(self, message):
 
-    def recieve(self):
+        if message.key in self.keys:
+            return self.handler(message)
 
-        for message in self.consumer:
-            print(message)
\ No newline at end of file
@@ -32,14 +32,19 @@ from numpy import sort
 import psutil
 import zmq
 from dataclasses import dataclass
-from time import sleep
 import psutil
 from kazoo.protocol.states import WatchedEvent
+import struct
 import time
 from collections import defaultdict
+from collections import deque
 
+from messages import CodecError
+from messages import CodecRegistry
 from messages import DissMessage
 from messages import RegistrationMessage
+from ownership import OwnershipTable
+from reactor import Reactor
 from zk_client import ZKClient
 
 @dataclass 
@@ -66,6 +71,10 @@ class Broker(Broker):
 
     prev_time: time.time
     num_requests: int
+    last_balanced: float
+
+    # Children of /BROKER as last reported by the watch set in start
+    broker_children: list = []
 
     pubs: defaultdict = defaultdict(list)
     subs: list = []
@@ -76,11 +85,28 @@ class Broker(Broker):
     pub_port: str
     type: str
 
+    # Dissemination from publishers arrives one way on the data socket,
+    # see receive_data
+    data_socket: object
+    data_port: str
+
     client: ZKClient
+    ownership: OwnershipTable
+    codecs: CodecRegistry
+    reactor: Reactor
+    load_interval: float = 1.0
+
+    # Client identity -> deque of (request id, frame) not yet handled,
+    # served round robin so one client's burst cannot hold up the others
+    pending: dict
+    max_receive: int = 1000
+    max_rounds: int = 100
+    serve_scheduled: bool = False
 
     leader: bool = False
     
-    def __init__ (self, server_port: str, pub_port: str, z_ip: str, z_port: str):
+    def __init__ (self, server_port: str, pub_port: str, z_ip: str, z_port: str, codecs: list = None, allow_pickle: bool = False,
+                  data_port: str = None):
         """ Initialization function for the broker class
 
         Arguements:
@@ -90,14 +116,27 @@ class Broker(Broker):
 
             type (str): Type of dissimination method to be used
 
+            codecs (list): Names of the wire codecs to accept, best
+            first (default: every available one but pickle)
+
+            allow_pickle (bool): Whether to accept pickled requests
+
+            data_port (str): Port for the data channel (default: any
+            free port, which proxies ask for)
+
         Returns:
             None
         """
         
         print("In Broker")
 
+        self.codecs = CodecRegistry(codecs, allow_pickle)
+        self.pending = {}
+
         self.prev_time = time.time()
         self.num_requests = 0
+        self.last_balanced = time.time()
+        self.broker_children = []
         self.replicas = {}
 
         self.get_self_ip()
@@ -106,15 +145,21 @@ class Broker(Broker):
         self.type = type
 
         self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.REP)
+        self.socket = self.context.socket(zmq.ROUTER)
         self.socket.bind(f"tcp://{self.ip}:{self.port}")
         
         pub_context = zmq.Context()
         self.pub_socket = pub_context.socket(zmq.PUB)
         self.pub_socket.bind(f"tcp://{self.ip}:{self.pub_port}")
 
-        self.poller = zmq.Poller()
-        self.poller.register(self.socket, zmq.POLLIN)
+        self.data_socket = self.context.socket(zmq.ROUTER)
+        if data_port:
+            self.data_socket.bind(f"tcp://{self.ip}:{data_port}")
+            self.data_port = str(data_port)
+        else:
+            self.data_port = str(self.data_socket.bind_to_random_port(f"tcp://{self.ip}"))
+
+        self.reactor = Reactor(self.context)
 
         self.register_znode(z_ip, z_port)
         self.replicas[self.get_name()] = 0
@@ -133,10 +178,10 @@ class Broker(Broker):
     
     def get_position(self):
 
-        children = self.client.client.get_children('/BROKER')
-        nodes = {i[0]: i[1] for i in (i.split("_") for i in children)}
+        # From the watched children, so no ZooKeeper round trip
+        nodes = {i[0]: i[1] for i in (i.split("_") for i in self.broker_children)}
         sorted_children = dict(sorted(nodes.items(), key=lambda item: item[1]))
-        self_pos = list(sorted_children.keys()).index(self.ip)
+        self_pos = list(sorted_children.keys()).index(self.ip) if self.ip in sorted_children else None
         
         return self_pos, sorted_children
 
@@ -181,22 +226,51 @@ class Broker(Broker):
 
     def handle_load(self):
 
+        # Per request: only counted, check_load acts on the count
         self.num_requests += 1
-        time_diff = time.time() - self.prev_time
+
+    def check_load(self):
+        """ Expand the cluster when the leader has seen many
+        requests in the current 10 second window, and shrink it
+        when a window ends with few requests and the cluster has
+        not changed for 15 seconds. Runs on a reactor timer, so
+        no request waits on the ZooKeeper calls this makes
+
+        Arguements:
+            None
+
+        Returns:
+            None
+        """
+
+        now = time.time()
+        window_ended = now - self.prev_time > 10
 
         if self.leader:
 
             sorted_children = self.get_position()[1]
-            
+
             if self.num_requests > 10:
                 self.balance_increased_load(sorted_children)
-            
-            elif self.num_requests <= 5 and time_diff > 15:
+                self.last_balanced = now
+
+            elif window_ended and self.num_requests <= 5 and now - self.last_balanced > 15:
                 self.balance_decreased_load(sorted_children)
-        
-        if  time_diff > 10:
-            self.prev_time = time.time()
-            self.num_requests = 0   
+                self.last_balanced = now
+
+        if window_ended:
+            self.prev_time = now
+            self.num_requests = 0
+
+    def handle_brokers_changed(self, children: list):
+
+        # On kazoo's thread: the update and leader check run on the reactor
+        self.reactor.call_soon_threadsafe(self.update_brokers, children)
+
+    def update_brokers(self, children: list):
+
+        self.broker_children = children
+        self.check_if_leader(children)
                 
     def trigger_reregistration(self):
 
@@ -212,13 +286,12 @@ class Broker(Broker):
 
     def check_topic_owndership(self, topic: str, ip: str):
 
-        children = self.client.get_children(f'/{topic}')
-        if ip == children[0]:
-            return True
+        return self.ownership.is_owner(topic, ip)
         
     def register_znode(self, z_ip: str, z_port: str):
 
         self.client = ZKClient(z_ip, z_port)
+        self.ownership = OwnershipTable(self.client.client)
             
         self.client.create_broker_znode(f"{self.ip}", f'{self.ip}:{self.port}')
         self.check_if_leader()
@@ -263,7 +336,9 @@ class Broker(Broker):
 
     def start(self) -> None:
         """ Function to loop and weight for requests to 
-        come from the server
+        come from the server. Requests, data, the load timer and
+        broker changes in ZooKeeper are all dispatched by one
+        reactor as they happen
 
         Arguements:
             None
@@ -272,23 +347,17 @@ class Broker(Broker):
             None
         """
         
-        while True:
+        self.reactor.add_reader(self.data_socket, self.receive_data)
+        self.reactor.add_reader(self.socket, self.serve_pending)
+        self.reactor.call_every(self.load_interval, self.check_load)
 
-            print('waiting')
-            events = dict(self.poller.poll(1000))
-            if self.socket in events:
+        # Stays registered, unlike a watch set by get_children
+        self.client.client.ChildrenWatch('/BROKER', self.handle_brokers_changed)
 
-                message = self.socket.recv_pyobj()
-                return_message = self.handle_request(message)
-                self.socket.send_pyobj(return_message)
-                print(message)
-                print(return_message)
-                print()
-            
-            sleep(1)
-            self.client.client.get_children('/BROKER', watch=self.check_if_leader)
+        print('waiting')
+        self.reactor.run()
   
-    def disseminate(self, message: DissMessage) -> None:
+    def disseminate(self, message: DissMessage) -> bool:
         """ Given a dissemination message, send it out using the 
         socket all subscribers are registered to. Only used for broker 
         method
@@ -297,15 +366,18 @@ class Broker(Broker):
             message (DissMessage): Message from publisher to send
 
         Returns:
-            None
+            sent (bool): Whether it was sent, False if the publisher
+            does not own the topic
         """
         
         topic, pub_ip, history_length = message.info()
 
         if self.check_topic_owndership(topic, pub_ip):
             self.pub_socket.send_string(f"{topic} {pub_ip} {history_length}")
-        else:
-            print("{} is not the owner of {}".format(pub_ip, topic))
+            return True
+
+        print("{} is not the owner of {}".format(pub_ip, topic))
+        return False
 
     def register(self, message: RegistrationMessage):
         """ Given a registration method, create a new node
@@ -340,6 +412,185 @@ class Broker(Broker):
 
         return self.pub_port
 
+    def receive_requests(self) -> None:
+        """ Queue the requests waiting on the ROUTER socket by the
+        client they came from, without blocking. Each arrives as
+        [identity, request id, frame] from a BrokerProxy DEALER
+
+        Arguements:
+            None
+
+        Returns:
+            None
+        """
+
+        for _ in range(self.max_receive):
+
+            try:
+                frames = self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+
+            if len(frames) != 3:
+                print(f"Dropped malformed request of {len(frames)} frames")
+                continue
+
+            identity, request_id, frame = frames
+            self.pending.setdefault(identity, deque()).append((request_id, frame))
+
+    def receive_data(self) -> None:
+        """ Disseminate the messages waiting on the data socket,
+        without blocking. Each arrives as [identity, sequence,
+        frame]; sequence 0 asks for no acknowledgement, otherwise
+        each client gets one ack once the batch is handled:
+        [highest sequence, sequences rejected], so a message that
+        was dropped is never reported as delivered
+
+        Arguements:
+            None
+
+        Returns:
+            None
+        """
+
+        # Identity -> [highest sequence, rejected sequences]
+        acks = {}
+
+        for _ in range(self.max_receive):
+
+            try:
+                frames = self.data_socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+            if len(frames) != 3 or len(frames[1]) != 8:
+                print(f"Dropped malformed data message of {len(frames)} frames")
+                continue
+
+            identity, sequence, frame = frames
+            (sequence,) = struct.unpack('>Q', sequence)
+            handled = self.handle_data(frame)
+
+            if sequence:
+                ack = acks.setdefault(identity, [0, []])
+                ack[0] = max(ack[0], sequence)
+
+                if not handled:
+                    ack[1].append(sequence)
+
+        for identity, (highest, rejected) in acks.items():
+            self.data_socket.send_multipart([identity, struct.pack('>Q', highest), struct.pack(f'>{len(rejected)}Q', *rejected)])
+
+    def handle_data(self, frame: bytes) -> bool:
+        """ Decode and disseminate one message of the data channel
+
+        Arguements:
+            frame (bytes): Frame received on the data socket
+
+        Returns:
+            handled (bool): Whether the message was disseminated
+        """
+
+        try:
+            message = self.codecs.decode(frame)
+
+            if type(message) is not DissMessage:
+                print(f"Dropped data message that is not a DissMessage: {message}")
+                return False
+
+            self.num_requests += 1
+            self.handle_load()
+
+            return self.disseminate(message)
+
+        except CodecError as error:
+            print(f"Rejected data message: {error}")
+
+        except Exception as error:
+            print(f"Failed to handle data message: {error!r}")
+
+        return False
+
+    def serve_pending(self) -> None:
+        """ Handle queued requests one client at a time, taking
+        one request from each client per round and picking up new
+        arrivals between rounds, for up to max_rounds rounds; the
+        rest waits for the next turn on the reactor so the data
+        socket, timers and ZooKeeper callbacks are not starved.
+        Every response carries the id of its request so a client
+        can have many outstanding
+
+        Arguements:
+            None
+
+        Returns:
+            None
+        """
+
+        self.receive_requests()
+
+        for _ in range(self.max_rounds):
+
+            if not self.pending:
+                return
+
+            for identity in list(self.pending):
+
+                queue = self.pending[identity]
+                request_id, frame = queue.popleft()
+                if not queue:
+                    del self.pending[identity]
+
+                message, return_frame = self.handle_frame(frame)
+                self.socket.send_multipart([identity, request_id, return_frame])
+                print(message)
+                print(return_frame)
+                print()
+
+            self.receive_requests()
+
+        # Already off the socket, so the poller will not report them
+        if self.pending and not self.serve_scheduled:
+            self.serve_scheduled = True
+            self.reactor.call_soon_threadsafe(self.serve_scheduled_pending)
+
+    def serve_scheduled_pending(self) -> None:
+
+        self.serve_scheduled = False
+        self.serve_pending()
+
+    def handle_frame(self, frame: bytes) -> tuple:
+        """ Given a request frame, answer a codec hello or decode
+        the request, handle it and encode the response in the
+        codec the request came in
+
+        Arguements:
+            frame (bytes): Frame received from a broker proxy
+
+        Returns:
+            message (object): The decoded request
+
+            response (bytes): Frame to send back, empty if the
+            request could not be decoded, handled or answered
+        """
+
+        message = frame
+
+        try:
+            if self.codecs.is_hello(frame):
+                return frame, self.codecs.answer(frame)
+
+            message = self.codecs.decode(frame)
+            return message, self.codecs.encode(self.handle_request(message), self.codecs.codec_of(frame))
+
+        except CodecError as error:
+            print(f"Rejected request: {error}")
+
+        except Exception as error:
+            print(f"Failed to handle request {message}: {error!r}")
+
+        return message, b''
+
     def handle_request(self, message: object):
         """ Given a message object, dictate if its a
         registration request or a dissementation method
@@ -368,6 +619,9 @@ class Broker(Broker):
         
         elif message == ["pub_port"]:
             return self.get_pub_port()
+
+        elif message == ["data_port"]:
+            return self.data_port
         
         elif message == ["load"]:
             return self.get_load()
@@ -22,8 +22,16 @@
  
 # Each item holds a broker proxy obeject
 # They just have the information on the ip and port of the actual broker so you can make calls to them
+import itertools
+import struct
+import threading
+import time
 import zmq
+from collections import OrderedDict
+from concurrent.futures import Future
 from dataclasses import dataclass
+from messages import CodecError
+from messages import CodecRegistry
 from messages import DissMessage
 from messages import RegistrationMessage
 
@@ -36,8 +44,22 @@ class BrokerProxy:
     socket: object
     context: object
     poller: zmq.Poller
+
+    codecs: CodecRegistry
+    codec: str
+
+    # Request id -> Future of the response. Requests go out on a DEALER
+    # socket, each with an id the broker echoes back, so any number can
+    # be outstanding and responses are matched however they arrive.
+    # socket_lock guards the socket, which zmq does not allow threads to
+    # share, and is only held to send and receive: waiting for responses
+    # polls the socket's file descriptor without it (see pump).
+    pending: dict
+    request_ids: itertools.count
+    socket_lock: threading.Lock
+    negotiate_lock: threading.Lock
         
-    def __init__(self, ip: str, port: str) -> None:
+    def __init__(self, ip: str, port: str, codecs: list = None, allow_pickle: bool = False) -> None:
         """ Initialization function. Given the ip and port of 
         the actual broker object, connect a socket to the brokers
         server
@@ -47,6 +69,11 @@ class BrokerProxy:
 
             port (str): Port of the broker server
 
+            codecs (list): Names of the wire codecs to offer the
+            broker, best first (default: every available one but pickle)
+
+            allow_pickle (bool): Whether pickle may be offered
+
         Returns:
             None
         """
@@ -56,12 +83,193 @@ class BrokerProxy:
         self.port = port
         self.poller = zmq.Poller()
 
+        self.codecs = CodecRegistry(codecs, allow_pickle)
+        self.codec = None
+
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+        self.socket_lock = threading.Lock()
+        self.negotiate_lock = threading.Lock()
+
         self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.REQ)
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
         self.socket.connect(f"tcp://{self.ip}:{self.port}")
-        self.poller.register (self.socket, zmq.POLLIN)
+        self.poller.register (self.socket.getsockopt(zmq.FD), zmq.POLLIN)
 
         print("finished bp initialization")
+
+    def negotiate(self, timeout: int = 15000) -> None:
+        """ Offer the broker the codecs this proxy speaks and
+        use the one it picks for every later request
+
+        Arguements:
+            timeout (int): Milliseconds to wait for the answer
+
+        Returns:
+            None
+        """
+
+        with self.negotiate_lock:
+
+            if self.codec is not None:
+                return
+
+            future = self.send_frame(self.codecs.hello())
+            answer = self.wait(future, timeout)
+
+            if answer is None:
+                raise CodecError('broker did not answer the codec hello')
+
+            self.codec = self.codecs.accepted(answer)
+            print(f'BP codec: {self.codec}')
+
+    def send_frame(self, frame: bytes) -> Future:
+        """ Send a frame tagged with a new request id
+
+        Arguements:
+            frame (bytes): Frame to send
+
+        Returns:
+            future (Future): Resolved with the response frame
+        """
+
+        request_id = struct.pack('>Q', next(self.request_ids))
+        future = Future()
+        future.request_id = request_id
+
+        with self.socket_lock:
+            self.pending[request_id] = future
+            self.socket.send_multipart([request_id, frame])
+            self.receive_responses()
+
+        return future
+
+    def submit(self, message: object, timeout: int = 15000) -> Future:
+        """ Send a message to the broker without waiting for the
+        response, so several can be outstanding at once
+
+        Arguements:
+            message (object): Message to send
+
+            timeout (int): Milliseconds to wait for the codec
+            negotiation, if it has not happened yet
+
+        Returns:
+            future (Future): Resolved with the response frame,
+            see result()
+        """
+
+        if self.codec is None:
+            self.negotiate(timeout)
+
+        return self.send_frame(self.codecs.encode(message, self.codec))
+
+    def pump(self, timeout: int) -> None:
+        """ Wait up to timeout for responses and resolve the
+        futures of every one that has arrived. Responses to
+        requests given up on are dropped
+
+        Arguements:
+            timeout (int): Milliseconds to wait
+
+        Returns:
+            None
+        """
+
+        with self.socket_lock:
+            if self.receive_responses():
+                return
+
+        # The file descriptor only signals that the socket may have
+        # changed, and whoever next uses the socket consumes that. So
+        # every holder of socket_lock receives whatever is readable
+        # before letting go, and waiting on it unlocked misses nothing
+        if self.poller.poll(timeout):
+            with self.socket_lock:
+                self.receive_responses()
+
+    def receive_responses(self) -> int:
+
+        # With socket_lock held: resolve the futures of every response
+        # waiting on the socket
+        received = 0
+
+        while True:
+
+            try:
+                frames = self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return received
+
+            received += 1
+
+            future = self.pending.pop(frames[0], None) if len(frames) == 2 else None
+            if future is not None:
+                future.set_result(frames[1])
+
+    def wait(self, future: Future, timeout: int = 15000) -> bytes:
+        """ Pump responses until future is resolved, by this
+        thread or another one
+
+        Arguements:
+            future (Future): Future of a request
+
+            timeout (int): Milliseconds to wait
+
+        Returns:
+            frame (bytes): The response frame, or None on timeout
+        """
+
+        deadline = time.monotonic() + timeout / 1000
+
+        while not future.done():
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.pending.pop(future.request_id, None)
+                return None
+
+            # Short slices, as another thread waiting at the same time
+            # may be the one to receive this response
+            self.pump(min(remaining, 0.05) * 1000)
+
+        return future.result()
+
+    def result(self, future: Future, timeout: int = 15000) -> object:
+        """ Wait for the response to a submitted message
+
+        Arguements:
+            future (Future): Future returned by submit
+
+            timeout (int): Milliseconds to wait
+
+        Returns:
+            message (object): Response of the broker, or "" if
+            there was none
+        """
+
+        frame = self.wait(future, timeout)
+        if frame:
+            return self.codecs.decode(frame)
+
+        return ""
+
+    def request(self, message: object, timeout: int = 15000) -> object:
+        """ Send a message to the broker in the negotiated codec
+        and wait for its response
+
+        Arguements:
+            message (object): Message to send
+
+            timeout (int): Milliseconds to wait for the response
+
+        Returns:
+            message (object): Response of the broker, or "" if
+            there was none
+        """
+
+        return self.result(self.submit(message, timeout), timeout)
     
     def get_pub_port(self) -> str:
         """ Get the port of the publisher
@@ -71,27 +279,34 @@ class BrokerProxy:
             port (str): Port of the publisher
         """
         
-        self.socket.send_pyobj(["pub_port"])
-        events = dict(self.poller.poll(15000))   
-        if self.socket in events:
+        message = self.request(["pub_port"])
+        print(f'BP message: {message or None}')
+        return message
 
-            message = self.socket.recv_pyobj()
-            print(f'BP message: {message}')
-            return message
-        
-        print(f'BP message - None')
-        return ""
+    def open_data_channel(self, acked: bool = False) -> 'DataChannel':
+        """ Ask the broker for its data port and open a one way
+        channel for dissemination to it
 
-    def get_load(self):
+        Arguements:
+            acked (bool): Whether the broker should acknowledge what
+            is sent on the channel
 
-        self.socket.send_pyobj(["load"])
-        events = dict(self.poller.poll(15000))   
-        if self.socket in events:
+        Returns:
+            channel (DataChannel): The opened channel
+        """
 
-            message = self.socket.recv_pyobj()
-            return message
-        
-        return ""
+        data_port = self.request(["data_port"])
+        if not data_port:
+            raise ConnectionError(f'broker {self.ip}:{self.port} did not give a data port')
+
+        if self.codec is None:
+            self.negotiate()
+
+        return DataChannel(self.context, self.ip, data_port, self.codecs, self.codec, acked)
+
+    def get_load(self):
+
+        return self.request(["load"])
 
 
     def register(self, type: str, topics: list, id: str, history_length: int) -> object:
@@ -111,16 +326,12 @@ class BrokerProxy:
         """
         
         print('sending registration')
-        self.socket.send_pyobj(RegistrationMessage(type, topics, id, history_length))
-        
-        events = dict(self.poller.poll(15000))   
-        if self.socket in events:
+        message = self.request(RegistrationMessage(type, topics, id, history_length))
 
-            message = self.socket.recv_pyobj()
+        if message != "":
             print('recieved registration')
-            return message
-        
-        return ""
+
+        return message
     
     def dessiminate(self, topic: str, value: str, history_length: int) -> None:
         """ Given the topic and value, dessiminate a message
@@ -138,15 +349,169 @@ class BrokerProxy:
         print('Starting Desiminating on BP')
 
         try:
-            self.socket.send_pyobj(DissMessage(topic, value, history_length))
-
-            events = dict(self.poller.poll(15000))   
-            if self.socket in events:
-
-                message = self.socket.recv_pyobj()
+            if self.request(DissMessage(topic, value, history_length)) != "":
                 print('Finished Desiminating on BP')
         except:
             print('Dessiminate failure')
-    
 
-    
\ No newline at end of file
+
+class DataChannel:
+
+    # Dissemination to a broker without a round trip per message: send()
+    # puts the message on a DEALER socket connected to the broker's data
+    # port and returns. With acked, each message carries a sequence
+    # number and stays in unacked until the broker acknowledges it; the
+    # broker acks cumulatively, once per batch it handles, so a single
+    # ack settles everything sent up to it except the sequences it lists
+    # as rejected, which move to rejected. Without it the sequence is 0
+    # and nothing comes back.
+
+    ip: str
+    port: str
+
+    codecs: CodecRegistry
+    codec: str
+    acked: bool
+
+    socket: object
+    lock: threading.Lock
+    closed: bool
+
+    sequences: itertools.count
+    unacked: OrderedDict
+    rejected: OrderedDict
+    sent: int
+
+    def __init__(self, context: object, ip: str, port: str, codecs: CodecRegistry, codec: str, acked: bool = False,
+                 high_water_mark: int = 10000) -> None:
+        """ Initialization function
+
+        Arguements:
+            context (object): zmq context to create the socket in
+
+            ip (str): Ip of the broker
+
+            port (str): Data port of the broker
+
+            codecs (CodecRegistry): Registry to encode with
+
+            codec (str): Codec negotiated with the broker
+
+            acked (bool): Whether to ask for acknowledgements
+
+            high_water_mark (int): Messages queued towards the broker
+            before send() blocks
+
+        Returns:
+            None
+        """
+
+        self.ip = ip
+        self.port = port
+
+        self.codecs = codecs
+        self.codec = codec
+        self.acked = acked
+
+        self.socket = context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.SNDHWM, high_water_mark)
+        self.socket.setsockopt(zmq.LINGER, 1000)
+        self.socket.connect(f"tcp://{self.ip}:{self.port}")
+
+        self.lock = threading.Lock()
+        self.closed = False
+
+        self.sequences = itertools.count(1)
+        self.unacked = OrderedDict()
+        self.rejected = OrderedDict()
+        self.sent = 0
+
+    def send(self, message: DissMessage) -> int:
+        """ Send a message to the broker without waiting
+
+        Arguements:
+            message (DissMessage): Message to disseminate
+
+        Returns:
+            sequence (int): Sequence number of the message, 0 if
+            unacknowledged or the channel is closed
+        """
+
+        frame = self.codecs.encode(message, self.codec)
+
+        with self.lock:
+
+            if self.closed:
+                print('Data channel closed, message dropped')
+                return 0
+
+            sequence = next(self.sequences) if self.acked else 0
+            if self.acked:
+                self.unacked[sequence] = message
+                self.receive_acks()
+
+            self.socket.send_multipart([struct.pack('>Q', sequence), frame])
+            self.sent += 1
+
+        return sequence
+
+    def publish(self, topic: str, value: str, history_length: int) -> int:
+
+        return self.send(DissMessage(topic, value, history_length))
+
+    def receive_acks(self, timeout: int = 0) -> None:
+
+        # Caller holds lock
+        if timeout and not self.socket.poll(timeout):
+            return
+
+        while True:
+
+            try:
+                frames = self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+
+            if len(frames) != 2 or len(frames[0]) != 8 or len(frames[1]) % 8:
+                print('Ignored malformed ack')
+                continue
+
+            (acked,) = struct.unpack('>Q', frames[0])
+            rejected = set(struct.unpack(f'>{len(frames[1]) // 8}Q', frames[1]))
+
+            while self.unacked and next(iter(self.unacked)) <= acked:
+
+                sequence, message = self.unacked.popitem(last=False)
+                if sequence in rejected:
+                    self.rejected[sequence] = message
+
+    def flush(self, timeout: int = 15000) -> bool:
+        """ Wait until the broker has acknowledged or rejected
+        everything sent so far. Always true without
+        acknowledgements
+
+        Arguements:
+            timeout (int): Milliseconds to wait
+
+        Returns:
+            acked (bool): Whether everything was acknowledged, false
+            if anything is left unacknowledged or was rejected
+        """
+
+        deadline = time.monotonic() + timeout / 1000
+
+        while True:
+
+            with self.lock:
+
+                remaining = deadline - time.monotonic()
+                if not self.unacked or remaining <= 0 or self.closed:
+                    return not self.unacked and not self.rejected
+
+                self.receive_acks(min(remaining, 0.05) * 1000)
+
+    def close(self) -> None:
+
+        with self.lock:
+            self.closed = True
+            self.socket.close()
@@ -0,0 +1,78 @@
+import sys
+import timeit
+
+from messages import CODECS
+from messages import CodecRegistry
+from messages import DissMessage
+from messages import RegistrationMessage
+
+# What goes between a broker proxy and the broker: dissemination and
+# registration requests, and the small replies to them
+SAMPLES = {
+    'diss': DissMessage('temperature', '10.0.0.5', 5),
+    'registration': RegistrationMessage('SUB', ['temperature', 'humidity', 'pressure', 'wind'], 'tcp://10.0.0.7:5556', 10),
+    'reply': ['10.0.0.2:5555', '10.0.0.3:5555'],
+}
+
+
+def measure(registry: CodecRegistry, codec: str, message: object, number: int) -> tuple:
+    """ Time encoding and decoding one message with one codec
+
+    Arguements:
+        registry (CodecRegistry): Registry holding the codec
+
+        codec (str): Name of the codec
+
+        message (object): Message to encode
+
+        number (int): Encodes and decodes to time
+
+    Returns:
+        encode_us (float): Microseconds per encode
+
+        decode_us (float): Microseconds per decode
+
+        size (int): Bytes per encoded frame, codec tag included
+    """
+
+    frame = registry.encode(message, codec)
+    assert registry.decode(frame) == message, f'{codec} does not round-trip {message}'
+
+    encode = min(timeit.repeat(lambda: registry.encode(message, codec), number=number, repeat=3))
+    decode = min(timeit.repeat(lambda: registry.decode(frame), number=number, repeat=3))
+
+    return encode / number * 1e6, decode / number * 1e6, len(frame)
+
+
+def main() -> None:
+    """ Prints encode and decode time and size per message for
+    every available codec. The number of iterations can be given
+    as the first arguement
+
+    Arguements:
+        None
+
+    Returns:
+        None
+    """
+
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    registry = CodecRegistry(allow_pickle=True)
+
+    missing = {'pickle', 'json', 'struct', 'msgpack', 'flatbuffers'} - {codec.name for codec in CODECS}
+    if missing:
+        print(f"Not installed: {', '.join(sorted(missing))}\n")
+
+    print(f"{'message':<14}{'codec':<13}{'encode us':>11}{'decode us':>11}{'bytes':>7}")
+
+    for sample, message in SAMPLES.items():
+        for codec in registry.names:
+
+            encode_us, decode_us, size = measure(registry, codec, message, number)
+            print(f"{sample:<14}{codec:<13}{encode_us:>11.2f}{decode_us:>11.2f}{size:>7}")
+
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,19 @@
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
+import json
+import pickle
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import flatbuffers
+    from flatbuffers.table import Table
+except ImportError:
+    flatbuffers = None
 
 @dataclass
 class DissMessage:
@@ -21,3 +36,392 @@ class RegistrationMessage:
     def info(self):
 
         return self.type, self.topics, self.id, self.history_length
+
+# Wire codecs for the messages between BrokerProxy and Broker.
+#
+# Every frame starts with one byte naming the codec that encoded the rest,
+# so a frame can always be decoded without knowing what the connection
+# agreed on. Inside the codecs each message is one of three kinds: a
+# DissMessage, a RegistrationMessage, or a plain value (the lists, strings
+# and None of the other requests and replies).
+#
+# A connection starts with a hello frame from the proxy listing the codecs
+# it speaks, best first. The broker answers with the first one it accepts,
+# and the proxy uses it from then on; the broker replies in whatever codec
+# the request came in. Pickle runs arbitrary code when decoding, so a
+# registry only accepts it when created with allow_pickle=True.
+
+HELLO = 0
+
+KIND_VALUE = 0
+KIND_DISS = 1
+KIND_REGISTRATION = 2
+
+class CodecError(ValueError):
+    pass
+
+def message_kind(message: object) -> int:
+
+    if type(message) is DissMessage:
+        return KIND_DISS
+
+    if type(message) is RegistrationMessage:
+        return KIND_REGISTRATION
+
+    return KIND_VALUE
+
+class Codec(ABC):
+
+    tag: int
+    name: str
+
+    @abstractmethod
+    def encode(self, message: object) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode(self, data: bytes) -> object:
+        pass
+
+class PickleCodec(Codec):
+
+    tag = 1
+    name = 'pickle'
+
+    def encode(self, message: object) -> bytes:
+
+        return pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data: bytes) -> object:
+
+        return pickle.loads(data)
+
+class JsonCodec(Codec):
+
+    # [kind, fields...] as JSON text
+
+    tag = 2
+    name = 'json'
+
+    def encode(self, message: object) -> bytes:
+
+        kind = message_kind(message)
+        fields = list(message.info()) if kind else [message]
+
+        return json.dumps([kind] + fields, separators=(',', ':')).encode()
+
+    def decode(self, data: bytes) -> object:
+
+        kind, *fields = json.loads(data)
+        return build_message(kind, fields)
+
+U8 = struct.Struct('<B')
+U16 = struct.Struct('<H')
+U32 = struct.Struct('<I')
+I32 = struct.Struct('<i')
+
+class StructCodec(Codec):
+
+    # Fixed layouts, little endian:
+    #
+    #   DissMessage          B kind | H len, topic | I len, value | i history
+    #   RegistrationMessage  B kind | H len, type | H count, (H len, topic)... |
+    #                        H len, id | i history
+    #   value                B kind | JSON text
+    #
+    # DissMessage.value is carried as a string, its declared type.
+
+    tag = 3
+    name = 'struct'
+
+    def encode(self, message: object) -> bytes:
+
+        kind = message_kind(message)
+
+        if kind == KIND_DISS:
+            topic = message.topic.encode()
+            value = str(message.value).encode()
+
+            return b''.join([U8.pack(kind), U16.pack(len(topic)), topic, U32.pack(len(value)), value, I32.pack(int(message.history_length))])
+
+        if kind == KIND_REGISTRATION:
+            node_type = message.type.encode()
+            node_id = message.id.encode()
+            parts = [U8.pack(kind), U16.pack(len(node_type)), node_type, U16.pack(len(message.topics))]
+
+            for topic in message.topics:
+                topic = topic.encode()
+                parts += [U16.pack(len(topic)), topic]
+
+            parts += [U16.pack(len(node_id)), node_id, I32.pack(int(message.history_length))]
+            return b''.join(parts)
+
+        return U8.pack(kind) + json.dumps(message, separators=(',', ':')).encode()
+
+    def decode(self, data: bytes) -> object:
+
+        kind = data[0]
+        offset = 1
+
+        def read_string(length_struct):
+            nonlocal offset
+            (length,) = length_struct.unpack_from(data, offset)
+            offset += length_struct.size + length
+            return data[offset - length:offset].decode()
+
+        try:
+            if kind == KIND_DISS:
+                topic = read_string(U16)
+                value = read_string(U32)
+                return DissMessage(topic, value, I32.unpack_from(data, offset)[0])
+
+            if kind == KIND_REGISTRATION:
+                node_type = read_string(U16)
+                (count,) = U16.unpack_from(data, offset)
+                offset += U16.size
+                topics = [read_string(U16) for _ in range(count)]
+                node_id = read_string(U16)
+                return RegistrationMessage(node_type, topics, node_id, I32.unpack_from(data, offset)[0])
+
+        except struct.error as error:
+            raise CodecError(f'truncated struct message: {error}')
+
+        return json.loads(data[1:])
+
+class MsgpackCodec(Codec):
+
+    # [kind, fields...] as MessagePack
+
+    tag = 4
+    name = 'msgpack'
+
+    def encode(self, message: object) -> bytes:
+
+        kind = message_kind(message)
+        fields = list(message.info()) if kind else [message]
+
+        return msgpack.packb([kind] + fields, use_bin_type=True)
+
+    def decode(self, data: bytes) -> object:
+
+        kind, *fields = msgpack.unpackb(data, raw=False)
+        return build_message(kind, fields)
+
+class FlatBuffersCodec(Codec):
+
+    # B kind, then a FlatBuffers table without generated code: slots in
+    # the field order of the message (DissMessage: topic, value, history;
+    # RegistrationMessage: type, [topics], id, history) or a single JSON
+    # string slot for a plain value
+
+    tag = 5
+    name = 'flatbuffers'
+
+    def encode(self, message: object) -> bytes:
+
+        kind = message_kind(message)
+        builder = flatbuffers.Builder(256)
+
+        if kind == KIND_DISS:
+            topic = builder.CreateString(message.topic)
+            value = builder.CreateString(str(message.value))
+
+            builder.StartObject(3)
+            builder.PrependUOffsetTRelativeSlot(0, topic, 0)
+            builder.PrependUOffsetTRelativeSlot(1, value, 0)
+            builder.PrependInt32Slot(2, int(message.history_length), 0)
+
+        elif kind == KIND_REGISTRATION:
+            topic_offsets = [builder.CreateString(topic) for topic in message.topics]
+            node_type = builder.CreateString(message.type)
+            node_id = builder.CreateString(message.id)
+
+            builder.StartVector(4, len(topic_offsets), 4)
+            for offset in reversed(topic_offsets):
+                builder.PrependUOffsetTRelative(offset)
+            topics = builder.EndVector()
+
+            builder.StartObject(4)
+            builder.PrependUOffsetTRelativeSlot(0, node_type, 0)
+            builder.PrependUOffsetTRelativeSlot(1, topics, 0)
+            builder.PrependUOffsetTRelativeSlot(2, node_id, 0)
+            builder.PrependInt32Slot(3, int(message.history_length), 0)
+
+        else:
+            value = builder.CreateString(json.dumps(message, separators=(',', ':')))
+
+            builder.StartObject(1)
+            builder.PrependUOffsetTRelativeSlot(0, value, 0)
+
+        builder.Finish(builder.EndObject())
+        return U8.pack(kind) + bytes(builder.Output())
+
+    def decode(self, data: bytes) -> object:
+
+        kind = data[0]
+        buf = bytearray(data[1:])
+        table = Table(buf, flatbuffers.encode.Get(flatbuffers.packer.uoffset, buf, 0))
+
+        def field(slot):
+            return table.Offset(4 + 2 * slot)
+
+        def string(slot):
+            offset = field(slot)
+            return table.String(offset + table.Pos).decode() if offset else ''
+
+        def int32(slot):
+            offset = field(slot)
+            return table.Get(flatbuffers.number_types.Int32Flags, offset + table.Pos) if offset else 0
+
+        if kind == KIND_DISS:
+            return DissMessage(string(0), string(1), int32(2))
+
+        if kind == KIND_REGISTRATION:
+            offset = field(1)
+            topics = []
+
+            if offset:
+                start = table.Vector(offset)
+                topics = [table.String(start + 4 * i).decode() for i in range(table.VectorLen(offset))]
+
+            return RegistrationMessage(string(0), topics, string(2), int32(3))
+
+        return json.loads(string(0))
+
+def build_message(kind: int, fields: list) -> object:
+
+    if kind == KIND_DISS:
+        return DissMessage(*fields)
+
+    if kind == KIND_REGISTRATION:
+        return RegistrationMessage(*fields)
+
+    if kind == KIND_VALUE and len(fields) == 1:
+        return fields[0]
+
+    raise CodecError(f'unknown message kind {kind}')
+
+# Every codec usable in this process, best first
+CODECS = [StructCodec(), MsgpackCodec() if msgpack else None, FlatBuffersCodec() if flatbuffers else None, JsonCodec(), PickleCodec()]
+CODECS = [codec for codec in CODECS if codec is not None]
+
+class CodecRegistry:
+
+    codecs: dict
+    names: dict
+
+    def __init__(self, allowed: list = None, allow_pickle: bool = False) -> None:
+        """ Initialization function
+
+        Arguements:
+            allowed (list): Names of the codecs to accept, best first
+            (default: every available codec)
+
+            allow_pickle (bool): Whether to accept pickle at all
+
+        Returns:
+            None
+        """
+
+        codecs = [codec for codec in CODECS if allowed is None or codec.name in allowed]
+
+        if allowed is not None:
+            codecs.sort(key=lambda codec: allowed.index(codec.name))
+
+        if not allow_pickle:
+            codecs = [codec for codec in codecs if codec.name != 'pickle']
+
+        self.codecs = {codec.tag: codec for codec in codecs}
+        self.names = {codec.name: codec for codec in codecs}
+
+    def encode(self, message: object, codec: str) -> bytes:
+        """ Encodes message as a frame tagged with its codec
+
+        Arguements:
+            message (object): Message to encode
+
+            codec (str): Name of the codec to use
+
+        Returns:
+            frame (bytes): The encoded frame
+        """
+
+        if codec not in self.names:
+            raise CodecError(f'codec {codec!r} is not accepted here')
+
+        selected = self.names[codec]
+
+        try:
+            return U8.pack(selected.tag) + selected.encode(message)
+        except (struct.error, TypeError, ValueError, OverflowError) as error:
+            raise CodecError(f'cannot encode {type(message).__name__} as {codec}: {error}')
+
+    def decode(self, frame: bytes) -> object:
+        """ Decodes a frame with the codec named by its first byte
+
+        Arguements:
+            frame (bytes): Frame to decode
+
+        Returns:
+            message (object): The decoded message
+        """
+
+        if not frame:
+            raise CodecError('empty frame')
+
+        codec = self.codecs.get(frame[0])
+        if codec is None:
+            raise CodecError(f'codec tag {frame[0]} is not accepted here')
+
+        try:
+            return codec.decode(frame[1:])
+        except CodecError:
+            raise
+        except Exception as error:
+            raise CodecError(f'malformed {codec.name} frame: {error}')
+
+    def codec_of(self, frame: bytes) -> str:
+
+        return self.codecs[frame[0]].name
+
+    @staticmethod
+    def is_hello(frame: bytes) -> bool:
+
+        return bool(frame) and frame[0] == HELLO
+
+    def hello(self) -> bytes:
+
+        return U8.pack(HELLO) + json.dumps(list(self.names)).encode()
+
+    def choose(self, hello: bytes) -> str:
+
+        # The first codec offered in a hello frame that is accepted here
+        try:
+            offered = json.loads(hello[1:])
+        except ValueError as error:
+            raise CodecError(f'malformed codec hello: {error}')
+
+        if not isinstance(offered, list):
+            raise CodecError('malformed codec hello: expected a list of codec names')
+
+        for name in offered:
+            if isinstance(name, str) and name in self.names:
+                return name
+
+        return None
+
+    def answer(self, hello: bytes) -> bytes:
+
+        # Reply to a hello frame: the chosen codec, null if none
+        return U8.pack(HELLO) + json.dumps(self.choose(hello)).encode()
+
+    def accepted(self, answer: bytes) -> str:
+
+        if not self.is_hello(answer):
+            raise CodecError('expected an answer to the codec hello')
+
+        codec = json.loads(answer[1:])
+        if codec not in self.names:
+            raise CodecError(f'no codec in common with the broker (it chose {codec!r})')
+
+        return codec
@@ -0,0 +1,160 @@
+###############################################
+#
+# Purpose: Topic ownership kept in memory from ZooKeeper watches
+#
+###############################################
+
+# Every publisher of a topic has an ephemeral znode /{topic}/{ip} holding
+# 'port:history_length:strength' (older publishers write only the first
+# two fields). The owner of a topic is the publisher with the highest
+# ownership strength, ties going to the one whose znode is oldest.
+#
+# The table keeps that order for every watched topic and is updated by a
+# kazoo ChildrenWatch whenever publishers come and go, so asking who owns
+# a topic is a dictionary lookup. Only the first question about a topic
+# talks to ZooKeeper, to start its watch.
+#
+# The table never creates topic nodes, since a broker is asked about any
+# topic string a client sends. A ChildrenWatch on a missing node stops for
+# good, so each topic has a DataWatch on its node (which survives the node
+# being missing) that starts the ChildrenWatch whenever the node appears.
+
+import threading
+from collections import namedtuple
+
+from kazoo.client import KazooClient
+from kazoo.exceptions import NoNodeError
+
+Owner = namedtuple('Owner', ['ip', 'port', 'history_length', 'strength', 'czxid'])
+
+
+def parse_owner_value(value: str) -> tuple:
+    """ Splits the value of a publisher znode
+
+    Arguements:
+        value (str): 'port:history_length' or
+        'port:history_length:strength'
+
+    Returns:
+        port (str): Port the publisher publishes on, blank when it
+        publishes via the broker
+
+        history_length (int): History the publisher keeps
+
+        strength (int): Ownership strength, 0 if not given
+    """
+
+    fields = value.split(":")
+    strength = int(fields[2]) if len(fields) > 2 and fields[2].strip() else 0
+
+    return fields[0], int(fields[1]), strength
+
+
+class OwnershipTable:
+
+    client: KazooClient
+
+    owners: dict
+    watched: set
+    children_watched: set
+    lock: threading.Lock
+
+    def __init__(self, client: KazooClient, topics: list = ()) -> None:
+        """ Initialization function
+
+        Arguements:
+            client (KazooClient): Started kazoo client
+
+            topics (list): Topics to watch straight away
+
+        Returns:
+            None
+        """
+
+        self.client = client
+
+        # Topic -> owners, best first. Replaced whole on every change, so
+        # readers never see one half updated
+        self.owners = {}
+        self.watched = set()
+        self.children_watched = set()
+        self.lock = threading.Lock()
+
+        for topic in topics:
+            self.watch(topic)
+
+    def watch(self, topic: str) -> None:
+        """ Start keeping the owners of topic, if not already
+
+        Arguements:
+            topic (str): Topic to watch
+
+        Returns:
+            None
+        """
+
+        with self.lock:
+
+            if topic in self.watched:
+                return
+
+            # Only marked once the watch is in place, so a failed first
+            # lookup is tried again on the next question
+            self.client.DataWatch(f'/{topic}', lambda data, stat: self.topic_changed(topic, stat))
+            self.watched.add(topic)
+
+    def topic_changed(self, topic: str, stat: object) -> None:
+
+        # On kazoo's thread (the first time on the caller's) whenever the
+        # topic node is created, changed or deleted
+        if stat is None:
+            self.children_watched.discard(topic)
+            self.owners[topic] = []
+
+        elif topic not in self.children_watched:
+            self.client.ChildrenWatch(f'/{topic}', lambda children: self.refresh(topic, children))
+            self.children_watched.add(topic)
+
+    def refresh(self, topic: str, children: list) -> None:
+
+        # On kazoo's thread, with the topic's current children
+        owners = []
+
+        for ip in children:
+
+            try:
+                value, stat = self.client.get(f'/{topic}/{ip}')
+                port, history_length, strength = parse_owner_value(value.decode("utf-8"))
+            except NoNodeError:
+                continue
+            except (ValueError, IndexError):
+                print(f"Ignoring malformed publisher znode /{topic}/{ip}")
+                continue
+
+            owners.append(Owner(ip, port, history_length, strength, stat.czxid))
+
+        owners.sort(key=lambda owner: (-owner.strength, owner.czxid))
+        self.owners[topic] = owners
+
+    def owners_of(self, topic: str) -> list:
+
+        self.watch(topic)
+        return self.owners.get(topic, [])
+
+    def owner(self, topic: str) -> Owner:
+        """ The current owner of topic
+
+        Arguements:
+            topic (str): Topic to look up
+
+        Returns:
+            owner (Owner): Its owner, None if it has no publishers
+        """
+
+        owners = self.owners_of(topic)
+        return owners[0] if owners else None
+
+    def is_owner(self, topic: str, ip: str) -> bool:
+
+        owner = self.owner(topic)
+        return owner is not None and owner.ip == ip
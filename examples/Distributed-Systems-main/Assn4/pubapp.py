@@ -20,6 +20,7 @@ def broker_test() -> None:
     z_ip = sys.argv[2]
     z_port = sys.argv[3]
     history_length = int(sys.argv[4])
+    strength = int(sys.argv[5]) if len(sys.argv) > 5 else 0
 
     topic_list = TopicList()
     topics = topic_list.interest()
@@ -30,7 +31,7 @@ def broker_test() -> None:
     if 'humidity' not in topics:
         topics.append('humidity')
 
-    p = PublisherProxy("Dissemination", z_ip, z_port, topics, history_length)
+    p = PublisherProxy("Dissemination", z_ip, z_port, topics, history_length, strength=strength)
     
     for i in range(6):
 
@@ -56,6 +57,7 @@ def direct_test() -> None:
     z_port = sys.argv[3]
     pub_port = sys.argv[4]
     history_length = int(sys.argv[5])
+    strength = int(sys.argv[6]) if len(sys.argv) > 6 else 0
 
     topic_list = TopicList()
     topics = topic_list.interest()
@@ -63,7 +65,7 @@ def direct_test() -> None:
     if 'pressure' not in topics:
         topics[0] = 'pressure'
 
-    p = PublisherProxy("Direct", z_ip, z_port, topics, history_length, pub_port)
+    p = PublisherProxy("Direct", z_ip, z_port, topics, history_length, pub_port, strength)
 
     while(True):
 
@@ -12,6 +12,8 @@
 # ABC stands for abstract base class and this is how Python library
 # defines the underlying abstract base class
 from abc import ABC, abstractmethod
+import threading
+import time
 import zmq
 import psutil
 from time import sleep
@@ -20,6 +22,8 @@ from uuid import uuid4
 from collections import deque
 
 from brokerproxy import BrokerProxy
+from brokerproxy import DataChannel
+from ownership import OwnershipTable
 
 
 # define an abstract base class for the publisher
@@ -39,6 +43,7 @@ class DirectPublisher (Publisher):
 
     history_length: int
     history: deque
+    strength: int
     
     start_sockert: object
     poller: object
@@ -47,8 +52,9 @@ class DirectPublisher (Publisher):
     pub_socket: object
 
     client: ZKClient
+    ownership: OwnershipTable
      
-    def __init__ (self, z_ip: str, z_port: str, port: str, topics: list, history_length: int) -> None:
+    def __init__ (self, z_ip: str, z_port: str, port: str, topics: list, history_length: int, strength: int = 0) -> None:
         """ Initialization function
 
         Arguements:
@@ -60,6 +66,9 @@ class DirectPublisher (Publisher):
 
             topics (list): Topics to publish on
 
+            strength (int): Ownership strength, the strongest
+            publisher of a topic being its owner
+
         Returns:
             None
         """
@@ -71,6 +80,7 @@ class DirectPublisher (Publisher):
 
         self.history_length = history_length
         self.history = deque(maxlen=self.history_length)
+        self.strength = strength
 
         self.client = ZKClient(z_ip, z_port)
 
@@ -79,12 +89,13 @@ class DirectPublisher (Publisher):
         self.pub_socket.bind(f"tcp://{self.ip}:{self.port}")
 
         self.register_topics()
+        self.ownership = OwnershipTable(self.client.client, self.topics)
 
     def register_topics(self):
 
         for topic in self.topics:
             print(f"Registering: {topic}/{self.ip}")
-            self.client.create_znode(f'{topic}/{self.ip}', f'{self.port}:{self.history_length}')
+            self.client.create_znode(f'{topic}/{self.ip}', f'{self.port}:{self.history_length}:{self.strength}')
 
     def get_self_ip(self) -> None:
         """ Gets actual IP of host
@@ -103,9 +114,7 @@ class DirectPublisher (Publisher):
 
     def check_topic_owndership(self, topic: str):
 
-        children = self.client.get_children(f'/{topic}')
-        if self.ip == children[0]:
-            return True
+        return self.ownership.is_owner(topic, self.ip)
 
     def publish (self, topic: str, value: str) -> None:
         """ Publishs message on it's pub socket
@@ -133,13 +142,18 @@ class ViaBrokerPublisher (Publisher):
 
     history_length: int
     history: deque
+    strength: int
     
     start_sockert: object
     poller: object
     
     client: ZKClient
 
-    def __init__ (self, z_ip: str, z_port: str, topics: list, history_length: int) -> None:
+    acked: bool
+    channel: DataChannel
+    channel_lock: threading.Lock
+
+    def __init__ (self, z_ip: str, z_port: str, topics: list, history_length: int, acked: bool = False, strength: int = 0) -> None:
         """ Initialization function
 
         Arguements:
@@ -149,6 +163,12 @@ class ViaBrokerPublisher (Publisher):
 
             topic: list
 
+            acked (bool): Whether the broker acknowledges published
+            messages, see flush
+
+            strength (int): Ownership strength, the strongest
+            publisher of a topic being its owner
+
         Returns:
             None
         """
@@ -156,6 +176,11 @@ class ViaBrokerPublisher (Publisher):
         self.topics = list(set(topics))
         print(self.topics)
 
+        self.acked = acked
+        self.channel = None
+        self.channel_lock = threading.Lock()
+        self.strength = strength
+
         self.history_length = history_length
         self.history = deque(maxlen=self.history_length)
 
@@ -173,21 +198,53 @@ class ViaBrokerPublisher (Publisher):
     
     def handle_broker_change(self, event):
 
+        # Watches fire once, so they are set again on every change, and
+        # before anything below can fail: a change after a failed
+        # attempt then tries again
+        self.client.client.exists('/BROKER', watch=self.handle_broker_change)
+        self.client.client.exists('/BALANCER', watch=self.handle_broker_change)
+
         response = False
         while not response:
             response = self.client.get_value('BROKER')
             sleep(1)
 
         broker_ip, broker_port = str(response).split(":")
-        self.bp = BrokerProxy(broker_ip, broker_port)
-        broker_ip, broker_port = self.bp.register("PUB", self.topics, self.id, self.history_length)[0].split(":")
-        self.bp = BrokerProxy(broker_ip, broker_port)
+        bp = BrokerProxy(broker_ip, broker_port)
+
+        brokers = bp.register("PUB", self.topics, self.id, self.history_length)
+        if not brokers:
+            raise ConnectionError(f'broker {broker_ip}:{broker_port} did not answer the registration')
+
+        broker_ip, broker_port = brokers[0].split(":")
+        bp = BrokerProxy(broker_ip, broker_port)
+        channel = bp.open_data_channel(self.acked)
+
+        # publish holds channel_lock, so nothing is sent on the old
+        # channel once it is swapped out; messages the old broker never
+        # acknowledged go to the new one
+        with self.channel_lock:
+
+            old_channel = self.channel
+            self.bp = bp
+            self.channel = channel
+
+            if old_channel is not None:
+
+                with old_channel.lock:
+                    old_channel.receive_acks()
+
+                old_channel.close()
+                channel.rejected.update(old_channel.rejected)
+
+                for message in old_channel.unacked.values():
+                    channel.send(message)
     
     def register_topics(self):
 
         for topic in self.topics:
             print(f"Registering: {topic}/{self.ip}")
-            self.client.create_znode(f'{topic}/{self.ip}', f' :{self.history_length}')
+            self.client.create_znode(f'{topic}/{self.ip}', f' :{self.history_length}:{self.strength}')
 
     def get_self_ip(self) -> None:
         """ Gets actual IP from host
@@ -205,8 +262,8 @@ class ViaBrokerPublisher (Publisher):
                 self.ip = addrs[key][0].address
 
     def publish (self, topic: str, value: str) -> None:
-        """ Publishs value by calling dessimatate on bp, 
-        which sends message on brokers server
+        """ Publishs value on the data channel to the broker,
+        without waiting for it
 
         Arguements:
             topic (str): Topic to publish on
@@ -217,7 +274,29 @@ class ViaBrokerPublisher (Publisher):
             None
         """
 
-        self.client.client.get('/BROKER', watch=self.handle_broker_change)
-        self.client.client.get('/BALANCER', watch=self.handle_broker_change)
-        self.bp.dessiminate(topic, value, self.history_length)
+        with self.channel_lock:
+            self.channel.publish(topic, value, self.history_length)
+
+    def flush(self, timeout: int = 15000) -> bool:
+        """ Wait until the broker has acknowledged everything
+        published so far (when created with acked)
+
+        Arguements:
+            timeout (int): Milliseconds to wait
+
+        Returns:
+            acked (bool): Whether nothing is left unacknowledged
+        """
+
+        deadline = time.monotonic() + timeout / 1000
+
+        # A broker change closes the channel being flushed; what it had
+        # not acknowledged was resent on the new one, so wait for that
+        while True:
+
+            channel = self.channel
+            acked = channel.flush(max(0, deadline - time.monotonic()) * 1000)
+
+            if channel is self.channel or time.monotonic() >= deadline:
+                return acked
         
\ No newline at end of file
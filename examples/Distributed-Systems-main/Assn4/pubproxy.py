@@ -28,7 +28,7 @@ class PublisherProxy:
     topics: list
     pub: publisher.Publisher
     
-    def __init__(self, type: str, z_ip: str, z_port: str, topics: list, history_length: int, pub_port: str = "") -> None:
+    def __init__(self, type: str, z_ip: str, z_port: str, topics: list, history_length: int, pub_port: str = "", strength: int = 0) -> None:
         """ Initialization function
 
         Arguements:
@@ -42,6 +42,8 @@ class PublisherProxy:
 
             pub_port (str): Port to publish on
 
+            strength (int): Ownership strength of the publisher
+
         Returns:
             None
         """
@@ -50,10 +52,10 @@ class PublisherProxy:
         self.topics = topics
 
         if self.type == "Direct":
-            self.pub = publisher.DirectPublisher(z_ip, z_port, pub_port, topics, history_length)
+            self.pub = publisher.DirectPublisher(z_ip, z_port, pub_port, topics, history_length, strength)
         
         elif self.type == "Dissemination":
-            self.pub = publisher.ViaBrokerPublisher(z_ip, z_port, topics, history_length)   # Send random list of topics
+            self.pub = publisher.ViaBrokerPublisher(z_ip, z_port, topics, history_length, strength=strength)   # Send random list of topics
             
     
     def publish(self, topic: str, value: str) -> None:
@@ -0,0 +1,252 @@
+###############################################
+#
+# Purpose: Single threaded event loop for the middleware layer
+#
+###############################################
+
+# One thread waits on every socket and timer at once and runs whatever is
+# ready, so nothing needs a fixed sleep. Other threads (kazoo's watch
+# callbacks, for instance) hand work to the loop with call_soon_threadsafe,
+# which queues the callback and wakes the poller through an inproc socket.
+
+import heapq
+import itertools
+import threading
+import time
+import zmq
+from collections import deque
+
+
+class Timer:
+
+    when: float
+    interval: float
+    callback: object
+    args: tuple
+    cancelled: bool
+
+    def __init__(self, when: float, interval: float, callback, args: tuple) -> None:
+
+        self.when = when
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> None:
+
+        self.cancelled = True
+
+
+class Reactor:
+
+    context: object
+    poller: zmq.Poller
+    readers: dict
+
+    timers: list
+    timer_ids: itertools.count
+
+    callbacks: deque
+    wake_socket: object
+    wake_sender: object
+    wake_lock: threading.Lock
+
+    running: bool
+    thread: threading.Thread
+
+    def __init__(self, context: object = None) -> None:
+        """ Initialization function
+
+        Arguements:
+            context (object): zmq context to create the wake up
+            sockets in, which has to be the one of every inproc
+            socket added (default: the global instance)
+
+        Returns:
+            None
+        """
+
+        self.context = context or zmq.Context.instance()
+        self.poller = zmq.Poller()
+        self.readers = {}
+
+        # (when, id, Timer), the id breaking ties between equal times
+        self.timers = []
+        self.timer_ids = itertools.count()
+
+        self.callbacks = deque()
+        address = f"inproc://reactor-wake-{id(self)}"
+
+        self.wake_socket = self.context.socket(zmq.PAIR)
+        self.wake_socket.bind(address)
+        self.wake_sender = self.context.socket(zmq.PAIR)
+        self.wake_sender.connect(address)
+        self.wake_lock = threading.Lock()
+
+        self.poller.register(self.wake_socket, zmq.POLLIN)
+
+        self.running = False
+        self.thread = None
+
+    def add_reader(self, socket: object, callback) -> None:
+        """ Call callback() whenever socket has something to read
+
+        Arguements:
+            socket (object): zmq socket or file descriptor
+
+            callback (function): Called with no arguements
+
+        Returns:
+            None
+        """
+
+        self.readers[socket] = callback
+        self.poller.register(socket, zmq.POLLIN)
+
+    def remove_reader(self, socket: object) -> None:
+
+        if self.readers.pop(socket, None) is not None:
+            self.poller.unregister(socket)
+
+    def call_later(self, delay: float, callback, *args) -> Timer:
+        """ Call callback(*args) once after delay seconds. Only
+        from the loop thread, see call_soon_threadsafe
+
+        Arguements:
+            delay (float): Seconds to wait
+
+            callback (function): Function to call
+
+        Returns:
+            timer (Timer): Timer that can be cancelled
+        """
+
+        return self.schedule(Timer(time.monotonic() + delay, None, callback, args))
+
+    def call_every(self, interval: float, callback, *args) -> Timer:
+        """ Call callback(*args) every interval seconds, the first
+        time after one interval
+
+        Arguements:
+            interval (float): Seconds between calls
+
+            callback (function): Function to call
+
+        Returns:
+            timer (Timer): Timer that can be cancelled
+        """
+
+        return self.schedule(Timer(time.monotonic() + interval, interval, callback, args))
+
+    def schedule(self, timer: Timer) -> Timer:
+
+        heapq.heappush(self.timers, (timer.when, next(self.timer_ids), timer))
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args) -> None:
+        """ Call callback(*args) on the loop thread as soon as
+        possible. Safe from any thread
+
+        Arguements:
+            callback (function): Function to call
+
+        Returns:
+            None
+        """
+
+        self.callbacks.append((callback, args))
+
+        # zmq sockets may not be shared between threads without a lock
+        with self.wake_lock:
+            try:
+                self.wake_sender.send(b'', zmq.NOBLOCK)
+            except zmq.Again:
+                pass
+
+    def run_callbacks(self) -> None:
+
+        while True:
+
+            try:
+                self.wake_socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+        # Only those queued so far, so callbacks queueing callbacks
+        # cannot keep the loop from polling
+        for _ in range(len(self.callbacks)):
+            callback, args = self.callbacks.popleft()
+            self.call(callback, *args)
+
+    def run_timers(self) -> None:
+
+        now = time.monotonic()
+
+        while self.timers and self.timers[0][0] <= now:
+
+            _, _, timer = heapq.heappop(self.timers)
+            if timer.cancelled:
+                continue
+
+            if timer.interval is not None:
+                timer.when = max(timer.when + timer.interval, now)
+                self.schedule(timer)
+
+            self.call(timer.callback, *timer.args)
+
+    def call(self, callback, *args) -> None:
+
+        # One failing callback must not take the loop down with it
+        try:
+            callback(*args)
+        except Exception as error:
+            print(f"Reactor callback {getattr(callback, '__name__', callback)} failed: {error!r}")
+
+    def timeout(self) -> float:
+
+        # Milliseconds until the next timer, None to wait for a socket
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+
+        if not self.timers:
+            return None
+
+        return max(0.0, (self.timers[0][0] - time.monotonic()) * 1000)
+
+    def run(self) -> None:
+        """ Dispatch socket events, timers and queued callbacks
+        until stop is called
+
+        Arguements:
+            None
+
+        Returns:
+            None
+        """
+
+        self.running = True
+        self.thread = threading.current_thread()
+
+        while self.running:
+
+            events = dict(self.poller.poll(self.timeout()))
+
+            if self.wake_socket in events:
+                self.run_callbacks()
+
+            for socket, callback in list(self.readers.items()):
+                if socket in events and socket in self.readers:
+                    self.call(callback)
+
+            self.run_timers()
+
+    def stop(self) -> None:
+
+        # Safe from any thread
+        self.call_soon_threadsafe(setattr, self, 'running', False)
+
+    def close(self) -> None:
+
+        self.wake_sender.close()
+        self.wake_socket.close()
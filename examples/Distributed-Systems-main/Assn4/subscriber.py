@@ -24,6 +24,7 @@ from time import sleep
 from uuid import uuid4
 
 from brokerproxy import BrokerProxy
+from ownership import parse_owner_value
 # define an abstract base class for the publisher
 
 class Subscriber (ABC):
@@ -86,7 +87,7 @@ class DirectSubscriber (Subscriber):
 
         for ip in new_pubs:
             
-            port, history_length = self.client.get_value(f'{self.topic}/{ip}').split(":")
+            port, history_length, _ = parse_owner_value(self.client.get_value(f'{self.topic}/{ip}'))
 
             if int(history_length) >= self.history_length:
                 socket = context.socket(zmq.SUB)
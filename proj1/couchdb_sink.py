@@ -0,0 +1,193 @@
+import couchdb_helper
+import sub
+
+import sys
+import threading
+
+from kafka import ConsumerRebalanceListener
+from kafka import TopicPartition
+
+class CouchDBSink:
+
+    # Persists every message of a topic as a tick document (see
+    # couchdb_helper.tick_doc), going through a BulkWriter so documents
+    # reach CouchDB in _bulk_docs batches instead of one request per
+    # message.
+    #
+    # Offsets are committed by hand, and only for messages whose documents
+    # the writer has flushed: a crash replays at most what was not yet in
+    # CouchDB. Each document's _id is '{topic}-{partition}-{offset}', so a
+    # replayed message conflicts with its earlier copy instead of being
+    # stored twice, and the writer counts that as written.
+    #
+    # Offsets are only kept for partitions assigned to this member. Before a
+    # rebalance takes partitions away, the writer is flushed and what it
+    # settled is committed, then the offsets of those partitions are
+    # dropped, so nothing is ever committed for a partition another member
+    # now owns.
+
+    subscriber: sub.Sub
+    couch: couchdb_helper.CouchDB
+    writer: couchdb_helper.BulkWriter
+
+    max_records: int
+
+    assigned: set
+    flushed: dict
+    committed: dict
+    blocked: dict
+    offsets_lock: threading.Lock
+
+    running: bool
+
+    def __init__(self, topic: str, db_name: str, couch: couchdb_helper.CouchDB = None, group_id: str = None,
+                 max_records: int = 500, **writer_options) -> None:
+
+        self.couch = couch or couchdb_helper.CouchDB()
+        self.couch.connect_to_db(db_name)
+        self.writer = self.couch.get_bulk_writer(conflicts_ok=True, on_flush=self.handle_flush, **writer_options)
+
+        self.max_records = max_records
+
+        # TopicPartition -> next offset to commit, as settled by the writer
+        self.assigned = set()
+        self.flushed = {}
+        self.committed = {}
+        self.blocked = {}
+        self.offsets_lock = threading.Lock()
+
+        self.running = False
+
+        # One group per database: another sink for the same database takes
+        # over where this one committed
+        self.subscriber = sub.Sub(topic, group_id=group_id or f'couchdb-sink-{db_name}', listener=SinkRebalanceListener(self),
+                                  enable_auto_commit=False)
+
+    @staticmethod
+    def doc_id(message) -> str:
+
+        return f'{message.topic}-{message.partition}-{message.offset}'
+
+    def make_doc(self, message) -> dict:
+
+        # A tick of the topic's ticker at the record's Kafka timestamp, plus
+        # where it was read from
+        value = message.value.decode()
+
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+
+        doc = couchdb_helper.tick_doc(message.topic, message.timestamp / 1000, {'value': value}, self.doc_id(message))
+        doc.update(partition=message.partition, offset=message.offset)
+
+        return doc
+
+    def handle_message(self, message) -> None:
+
+        self.writer.add(self.make_doc(message))
+
+    def handle_flush(self, docs: list, failed: list) -> None:
+
+        # On the writer's flushing thread. A document given up on holds its
+        # partition's commits at its offset for the rest of the run, so it
+        # is retried from Kafka after a restart.
+        with self.offsets_lock:
+
+            for doc in failed:
+                tp = TopicPartition(self.subscriber.topic, doc['partition'])
+                if tp not in self.assigned:
+                    continue
+
+                self.blocked[tp] = min(self.blocked.get(tp, doc['offset']), doc['offset'])
+
+            for doc in docs:
+                tp = TopicPartition(self.subscriber.topic, doc['partition'])
+                if tp not in self.assigned:
+                    continue
+
+                offset = min(doc['offset'] + 1, self.blocked.get(tp, doc['offset'] + 1))
+
+                if offset > self.flushed.get(tp, -1):
+                    self.flushed[tp] = offset
+
+    def commit_flushed(self) -> None:
+
+        # On the polling thread, as KafkaConsumer is not thread safe
+        with self.offsets_lock:
+            offsets = {tp: offset for tp, offset in self.flushed.items() if self.committed.get(tp) != offset}
+
+        if offsets and self.subscriber.commit(offsets):
+            self.committed.update(offsets)
+
+    def handle_assigned(self, partitions: list) -> None:
+
+        with self.offsets_lock:
+            self.assigned.update(partitions)
+
+    def handle_revoked(self, partitions: list) -> None:
+
+        # On the polling thread, inside poll, while the partitions are
+        # still this member's to commit
+        self.writer.flush()
+        self.commit_flushed()
+
+        with self.offsets_lock:
+            for tp in partitions:
+                self.assigned.discard(tp)
+                self.flushed.pop(tp, None)
+                self.committed.pop(tp, None)
+                self.blocked.pop(tp, None)
+
+    def run(self) -> None:
+
+        self.running = True
+
+        try:
+            while self.running:
+
+                for message in self.subscriber.poll(self.max_records):
+                    self.handle_message(message)
+
+                self.commit_flushed()
+
+        finally:
+            self.close()
+
+    def stop(self) -> None:
+
+        self.running = False
+
+    def close(self) -> None:
+
+        self.writer.close()
+        self.commit_flushed()
+        self.subscriber.consumer.close(autocommit=False)
+
+class SinkRebalanceListener(ConsumerRebalanceListener):
+
+    sink: CouchDBSink
+
+    def __init__(self, sink: CouchDBSink) -> None:
+
+        self.sink = sink
+
+    def on_partitions_revoked(self, revoked) -> None:
+
+        self.sink.handle_revoked(revoked)
+
+    def on_partitions_assigned(self, assigned) -> None:
+
+        self.sink.handle_assigned(assigned)
+
+def main():
+
+    topic = sys.argv[1]
+    db_name = sys.argv[2] if len(sys.argv) > 2 else topic.lower()
+
+    sink = CouchDBSink(topic, db_name)
+    sink.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import unquote
+from urllib.parse import urlsplit
+
+# An in-memory server speaking enough of the CouchDB HTTP API for
+# couchdb_helper (create/open a database, save a document, _bulk_docs,
+# _changes including longpoll, Mango _index and _find) to run and be
+# benchmarked without a real CouchDB. Credentials are ignored.
+
+# Mango operators the stand-in understands
+OPERATORS = {
+    '$eq': lambda a, b: a == b,
+    '$gt': lambda a, b: a > b,
+    '$gte': lambda a, b: a >= b,
+    '$lt': lambda a, b: a < b,
+    '$lte': lambda a, b: a <= b,
+}
+
+def matches(doc: dict, selector: dict) -> bool:
+
+    for field, condition in selector.items():
+
+        if field not in doc:
+            return False
+
+        value = doc[field]
+        conditions = condition if isinstance(condition, dict) else {'$eq': condition}
+
+        try:
+            if not all(OPERATORS[op](value, operand) for op, operand in conditions.items()):
+                return False
+        except TypeError:
+            return False
+
+    return True
+
+class CouchDBStandIn:
+
+    databases: dict
+    seqs: dict
+    changes: dict
+    indexes: dict
+    lock: threading.Lock
+    changed: threading.Condition
+
+    def __init__(self) -> None:
+
+        self.databases = {}
+
+        # name -> last update sequence, and name -> {doc id: sequence of
+        # its latest change}, kept in sequence order
+        self.seqs = {}
+        self.changes = {}
+
+        # name -> [index definitions]
+        self.indexes = {}
+
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+    def save(self, name: str, doc: dict) -> tuple:
+
+        db = self.databases[name]
+
+        doc = dict(doc)
+        doc_id = doc.setdefault('_id', uuid.uuid4().hex)
+        current = db.get(doc_id)
+
+        if current is not None and doc.get('_rev') != current['_rev']:
+            return 409, {'id': doc_id, 'error': 'conflict', 'reason': 'Document update conflict.'}
+
+        generation = int(current['_rev'].split('-')[0]) + 1 if current else 1
+        doc['_rev'] = f'{generation}-{uuid.uuid4().hex}'
+        db[doc_id] = doc
+
+        self.seqs[name] += 1
+        self.changes[name].pop(doc_id, None)
+        self.changes[name][doc_id] = self.seqs[name]
+        self.changed.notify_all()
+
+        return 201, {'ok': True, 'id': doc_id, 'rev': doc['_rev']}
+
+    def changes_since(self, name: str, query: dict) -> tuple:
+
+        # Caller holds lock. Sequences are '{n}-standin' strings, opaque to
+        # clients as in CouchDB 2+
+        since = query.get('since', ['0'])[0]
+        since = self.seqs[name] if since == 'now' else int(since.split('-')[0])
+        limit = int(query.get('limit', [0])[0]) or None
+        include_docs = query.get('include_docs', ['false'])[0] == 'true'
+
+        if query.get('feed', [''])[0] == 'longpoll' and self.seqs[name] <= since:
+            deadline = time.monotonic() + int(query.get('timeout', [60000])[0]) / 1000
+
+            while self.seqs.get(name, 0) <= since and name in self.databases:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+
+                self.changed.wait(left)
+
+            if name not in self.databases:
+                return 404, {'error': 'not_found', 'reason': 'Database does not exist.'}
+
+        results = []
+        for doc_id, seq in self.changes[name].items():
+
+            if seq <= since:
+                continue
+
+            doc = self.databases[name][doc_id]
+            change = {'seq': f'{seq}-standin', 'id': doc_id, 'changes': [{'rev': doc['_rev']}]}
+            if include_docs:
+                change['doc'] = doc
+
+            results.append(change)
+            if limit and len(results) >= limit:
+                break
+
+        last_seq = results[-1]['seq'] if results else f'{max(since, 0)}-standin'
+
+        return 200, {'results': results, 'last_seq': last_seq, 'pending': 0}
+
+    def create_index(self, name: str, body: dict) -> tuple:
+
+        index = {
+            'ddoc': f"_design/{body.get('ddoc') or uuid.uuid4().hex}",
+            'name': body.get('name') or uuid.uuid4().hex,
+            'type': 'json',
+            'def': {'fields': body['index']['fields']},
+        }
+
+        for existing in self.indexes[name]:
+            if existing['ddoc'] == index['ddoc'] and existing['name'] == index['name']:
+                return 200, {'result': 'exists', 'id': index['ddoc'], 'name': index['name']}
+
+        self.indexes[name].append(index)
+        return 200, {'result': 'created', 'id': index['ddoc'], 'name': index['name']}
+
+    def find(self, name: str, body: dict) -> tuple:
+
+        # Like CouchDB, a sorted query needs an index over its sort fields.
+        # The bookmark is the position to carry on from.
+        sort = [next(iter(field)) if isinstance(field, dict) else field for field in body.get('sort', [])]
+
+        if sort and not any([next(iter(f)) for f in index['def']['fields']][:len(sort)] == sort for index in self.indexes[name]):
+            return 400, {'error': 'no_usable_index', 'reason': 'No index exists for this sort, try indexing by the sort fields.'}
+
+        docs = [doc for doc in self.databases[name].values() if matches(doc, body.get('selector', {}))]
+        if sort:
+            docs.sort(key=lambda doc: [doc.get(field) for field in sort])
+
+        start = int(body.get('bookmark') or 0)
+        limit = body.get('limit', 25)
+        page = docs[start:start + limit]
+
+        if body.get('fields'):
+            page = [{field: doc[field] for field in body['fields'] if field in doc} for doc in page]
+
+        return 200, {'docs': page, 'bookmark': str(start + len(page))}
+
+    def handle(self, method: str, path: str, body: object) -> tuple:
+
+        url = urlsplit(path)
+        parts = [unquote(part) for part in url.path.split('/') if part]
+
+        if not parts:
+            return 200, {'couchdb': 'Welcome', 'version': '3.2.0'}
+
+        name = parts[0]
+
+        with self.lock:
+
+            db = self.databases.get(name)
+
+            if len(parts) == 1:
+
+                if method == 'PUT':
+                    if db is not None:
+                        return 412, {'error': 'file_exists', 'reason': 'The database could not be created, the file already exists.'}
+
+                    self.databases[name] = {}
+                    self.seqs[name] = 0
+                    self.changes[name] = {}
+                    self.indexes[name] = []
+                    return 201, {'ok': True}
+
+                if db is None:
+                    return 404, {'error': 'not_found', 'reason': 'Database does not exist.'}
+
+                if method in ('GET', 'HEAD'):
+                    return 200, {'db_name': name, 'doc_count': len(db)}
+
+                if method == 'POST':
+                    return self.save(name, body)
+
+                if method == 'DELETE':
+                    del self.databases[name]
+                    del self.seqs[name]
+                    del self.changes[name]
+                    del self.indexes[name]
+                    self.changed.notify_all()
+                    return 200, {'ok': True}
+
+            if db is None:
+                return 404, {'error': 'not_found', 'reason': 'Database does not exist.'}
+
+            if parts[1] == '_bulk_docs' and method == 'POST':
+                return 201, [self.save(name, doc)[1] for doc in body['docs']]
+
+            if parts[1] == '_changes' and method == 'GET':
+                return self.changes_since(name, parse_qs(url.query))
+
+            if parts[1] == '_index' and method == 'POST':
+                return self.create_index(name, body)
+
+            if parts[1] == '_index' and method == 'GET':
+                return 200, {'total_rows': len(self.indexes[name]), 'indexes': self.indexes[name]}
+
+            if parts[1] == '_find' and method == 'POST':
+                return self.find(name, body)
+
+            doc_id = '/'.join(parts[1:])
+
+            if method in ('GET', 'HEAD'):
+                if doc_id not in db:
+                    return 404, {'error': 'not_found', 'reason': 'missing'}
+
+                return 200, db[doc_id]
+
+            if method == 'PUT':
+                return self.save(name, dict(body, _id=doc_id))
+
+        return 405, {'error': 'method_not_allowed', 'reason': f'{method} {path}'}
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    standin: CouchDBStandIn
+
+    def respond(self) -> None:
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+
+        status, payload = self.standin.handle(self.command, self.path, body)
+        data = json.dumps(payload).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = respond
+
+    def log_message(self, format, *args) -> None:
+
+        pass
+
+def serve(host: str = '127.0.0.1', port: int = 5984) -> ThreadingHTTPServer:
+
+    handler = type('StandInHandler', (RequestHandler,), {'standin': CouchDBStandIn()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+def main():
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5984
+    server = serve(port=port)
+
+    print(f"CouchDB stand-in listening on {server.server_address[0]}:{server.server_address[1]}")
+    threading.Event().wait()
+
+if __name__ == "__main__":
+    main()
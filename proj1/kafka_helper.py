@@ -17,9 +17,10 @@ class Kafka:
         
         os.system(f'kafka/bin/kafka-topics.sh --create --zookeeper {self.host_ip}:{self.host_port} --replication-factor {replication_factor} --partitions {num_partitions} --topic {topic_name}')
 
-    def get_consumer(self, topic_name: str) -> KafkaConsumer:
+    def get_consumer(self, topic_name: str, **configs) -> KafkaConsumer:
 
-        return KafkaConsumer(topic_name, bootstrap_servers=f'{self.host_ip}:9092', group_id='test')
+        configs.setdefault('group_id', 'test')
+        return KafkaConsumer(topic_name, bootstrap_servers=f'{self.host_ip}:9092', **configs)
     
     def get_producer(self,) -> KafkaProducer:
         
@@ -1,6 +1,9 @@
 import kafka_helper
 
+from kafka import ConsumerRebalanceListener
 from kafka import KafkaConsumer
+from kafka import OffsetAndMetadata
+from kafka.errors import CommitFailedError
 from time import sleep
 
 class Sub:
@@ -10,14 +13,21 @@ class Sub:
 
     topic: str
 
-    def __init__(self, topic: str):
+    def __init__(self, topic: str, group_id: str = 'test', listener: ConsumerRebalanceListener = None, **consumer_configs):
         
         self.topic = topic
 
         self.k_utility = kafka_helper.Kafka('10.0.0.1', '2181')
         self.wait_for_topic_creation()
 
-        self.consumer = self.k_utility.get_consumer(self.topic)
+        # Pass enable_auto_commit=False to commit with commit() once what
+        # was polled has been processed
+        self.consumer = self.k_utility.get_consumer(self.topic, group_id=group_id, **consumer_configs)
+
+        # A listener is told when the group moves partitions to or from this
+        # member, so it can commit what it has done before losing them
+        if listener is not None:
+            self.consumer.subscribe([self.topic], listener=listener)
 
     def wait_for_topic_creation(self):
 
@@ -31,7 +41,27 @@ class Sub:
                 print("waiting for topic to be created")
 
 
-    def recieve(self):
+    def recieve(self, handler=None):
+
+        handler = handler or print
 
         for message in self.consumer:
-            print(message)
\ No newline at end of file
+            handler(message)
+
+    def poll(self, max_records: int = 500, timeout_ms: int = 1000) -> list:
+
+        batches = self.consumer.poll(timeout_ms=timeout_ms, max_records=max_records)
+        return [message for messages in batches.values() for message in messages]
+
+    def commit(self, offsets: dict) -> bool:
+
+        # offsets is TopicPartition -> offset of the next message to read.
+        # Fails (returning False) if the partitions were reassigned to
+        # another member in the meantime; it picks up from the last commit.
+        try:
+            self.consumer.commit({tp: OffsetAndMetadata(offset, '') for tp, offset in offsets.items()})
+            return True
+
+        except CommitFailedError as error:
+            print(f"offset commit failed: {error}")
+            return False